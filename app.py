@@ -34,7 +34,7 @@ sys.path.append(str(Path(__file__).parent))
 from services.file_manager import FileManager
 from services.excel_processor import ExcelProcessor
 from services.chart_builder import ChartBuilder
-from services.llm_agent import LLMAgent
+from services.llm_agent import get_agent
 from services.paypal_service import PayPalService
 from services.user_service import UserService
 from utils.validator import DataValidator
@@ -107,7 +107,7 @@ def get_current_user(credentials: Optional[HTTPAuthorizationCredentials] = Depen
 
 # Initialize LLM agent with OpenAI GPT-4.1 (will raise error if API key not set)
 try:
-    llm_agent = LLMAgent()
+    llm_agent = get_agent()
 except ValueError as e:
     print(f"Warning: {e}")
     llm_agent = None
@@ -312,7 +312,7 @@ async def process_file(
         # Get user_id for feedback tracking
         user_id = user["user_id"] if user else None
         
-        llm_result = llm_agent.interpret_prompt(
+        llm_result = await llm_agent.ainterpret_prompt(
             prompt,
             available_columns,
             user_id=user_id,
@@ -680,7 +680,7 @@ async def process_data(
         if user:
             user_id = user["user_id"]
         
-        llm_result = llm_agent.interpret_prompt(
+        llm_result = await llm_agent.ainterpret_prompt(
             request.prompt,
             available_columns,
             user_id=user_id,
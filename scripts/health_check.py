@@ -52,8 +52,8 @@ def check_llm_agent():
     """Check LLM agent is configured"""
     print("\n🤖 Checking LLM Agent...")
     try:
-        from services.llm_agent import LLMAgent
-        agent = LLMAgent()
+        from services.llm_agent import get_agent
+        agent = get_agent()
         
         print(f"   ✅ LLM Agent initialized")
         print(f"      - Model: {agent.model}")
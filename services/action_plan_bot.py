@@ -9,16 +9,17 @@ Does NOT handle charts - those go to ChartBot.
 import json
 import os
 import logging
+import re
+from functools import cached_property
 from typing import Dict, List, Optional
 from openai import OpenAI
 from dotenv import load_dotenv
 
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).parent.parent))
-from utils.prompts import get_prompt_with_context, get_column_mapping_info
+from utils.prompts import SYSTEM_PROMPT, get_prompt_with_context, get_column_mapping_info
 from utils.knowledge_base import get_knowledge_base_summary, get_task_decision_guide
+from utils.json_extract import parse_json_object
 from services.feedback_learner import FeedbackLearner
+from services.llm_stream import create_openai_client, stream_json_completion
 from services.training_data_loader import TrainingDataLoader
 from services.extraction_pattern_analyzer import ExtractionPatternAnalyzer
 
@@ -737,17 +738,48 @@ PATTERN RECOGNITION PRINCIPLES:
 12. CRITICAL: When removing/replacing special characters (*, ?, +, etc.), ALWAYS use regex=False to avoid regex errors
 """
 
+# Top-level plan fields kept by _normalize_action_plan besides "operations"
+_PASSTHROUGH_PLAN_KEYS = frozenset({
+    "add_row", "add_column", "delete_column", "delete_rows", "sort",
+    "conditional_format", "format", "filters", "task",
+})
+
+# "X rows selected from Y total" in SampleSelector explanations
+_ROWS_SELECTED_PATTERN = re.compile(r'(\d+)\s+rows?\s+selected\s+from\s+(\d+)\s+total', re.IGNORECASE)
+
+
+def _operations_preview(operations: List) -> str:
+    """Short description/code preview of plan operations, for debug logging"""
+    return json.dumps(
+        [
+            {
+                "description": op.get("description", "No desc"),
+                "python_code": (op.get("python_code") or "")[:50],
+            }
+            for op in operations
+            if isinstance(op, dict)
+        ],
+        indent=2,
+    )
+
 
 class ActionPlanBot:
     """Bot for generating data operation action plans"""
     
-    def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4o-mini"):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "gpt-4o-mini",
+        client: Optional[OpenAI] = None
+    ):
         """
         Initialize Action Plan Bot
         
         Args:
             api_key: OpenAI API key
             model: Model to use (default: gpt-4o-mini for cost savings, optimized for JSON outputs)
+            client: OpenAI client to share (e.g. LLMAgent's), so all bots reuse
+                one connection pool; a new one is created if omitted
         """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
@@ -755,26 +787,48 @@ class ActionPlanBot:
         
         # Use provided model directly (no env var override) since LLMAgent handles routing
         self.model = model
-        self.client = OpenAI(api_key=self.api_key)
+        self.client = client or create_openai_client(self.api_key)
         
-        # Initialize feedback learner
+        self.refresh_system_prompt()
+    
+    @cached_property
+    def feedback_learner(self) -> Optional[FeedbackLearner]:
+        """Feedback learner for few-shot examples, created on first use (None if unavailable)"""
         try:
-            self.feedback_learner = FeedbackLearner()
+            return FeedbackLearner()
         except Exception:
-            self.feedback_learner = None
-        
-        # Initialize training data loader
+            return None
+    
+    @cached_property
+    def training_data_loader(self) -> Optional[TrainingDataLoader]:
+        """Training data loader for few-shot examples, created on first use (None if unavailable)"""
         try:
-            self.training_data_loader = TrainingDataLoader()
+            return TrainingDataLoader()
         except Exception:
-            self.training_data_loader = None
+            return None
+    
+    def refresh_system_prompt(self):
+        """
+        (Re)build the system prompt from the current knowledge base
+        
+        The knowledge base summary and the generic prompt rules are static, so
+        they are assembled once into the system prompt, where OpenAI's
+        automatic prefix caching can reuse them across requests.
+        """
+        kb_summary = get_knowledge_base_summary()
+        system_parts = [ACTION_PLAN_SYSTEM_PROMPT]
+        if kb_summary:
+            system_parts.append(f"{kb_summary}\n")
+        system_parts.append(SYSTEM_PROMPT)
+        self.system_prompt = "\n".join(system_parts)
     
     def generate_action_plan(
         self,
         user_prompt: str,
         available_columns: List[str],
         sample_data: Optional[List[Dict]] = None,
-        sample_explanation: Optional[str] = None
+        sample_explanation: Optional[str] = None,
+        model: Optional[str] = None
     ) -> Dict:
         """
         Generate action plan with Python code
@@ -784,161 +838,154 @@ class ActionPlanBot:
             available_columns: Available column names
             sample_data: Sample data rows
             sample_explanation: Explanation of sample data
+            model: Model for this call (defaults to the bot's model)
         
         Returns:
             Action plan dict with operations
         """
         try:
-            # Extract total rows from sample_explanation if available
-            total_rows = None
-            if sample_explanation:
-                import re
-                # Extract "X rows selected from Y total" pattern
-                match = re.search(r'(\d+)\s+rows?\s+selected\s+from\s+(\d+)\s+total', sample_explanation, re.IGNORECASE)
-                if match:
-                    total_rows = int(match.group(2))
+            messages = self.build_messages(user_prompt, available_columns, sample_data, sample_explanation)
             
-            # Build prompt with total row count
-            prompt = get_prompt_with_context(user_prompt, available_columns, sample_data, total_rows=total_rows)
-            
-            # Get knowledge base summary
-            kb_summary = get_knowledge_base_summary()
-            
-            # Get task suggestions (simplified output)
-            task_suggestions = get_task_decision_guide(user_prompt)
-            task_hint = task_suggestions.get('suggested_task', 'auto-detect')
-            
-            # Get column mapping info (Excel letters → actual column names) - simplified
-            column_mapping = get_column_mapping_info(available_columns)
-            
-            # Build concise prompt - remove verbose sections
-            # Only include essential context
-            prompt_parts = []
-            
-            # Knowledge base (ultra-concise)
-            if kb_summary:
-                prompt_parts.append(f"Tasks: {kb_summary}")
-            
-            # Task hint (one line)
-            if task_hint != 'auto-detect':
-                prompt_parts.append(f"Task hint: {task_hint}")
-            
-            # Column mapping (essential for Excel letter references)
-            if column_mapping:
-                prompt_parts.append(column_mapping)
-            
-            # Main prompt with sample data
-            prompt_parts.append(prompt)
-            
-            # Build final prompt
-            full_prompt = "\n\n".join(prompt_parts) + "\n\nReturn ONLY valid JSON with operations array containing python_code for each operation."
-
-            response = self.client.chat.completions.create(
-                model=self.model,
-                messages=[
-                    {"role": "system", "content": ACTION_PLAN_SYSTEM_PROMPT},
-                    {"role": "user", "content": full_prompt}
-                ],
+            # Streamed so parsing can start the moment the JSON object closes
+            content, prompt_tokens, completion_tokens, cached_tokens = stream_json_completion(
+                self.client, model=model or self.model, messages=messages
             )
+            content = content.strip()
+            logger.info("📥 Raw LLM response (first 500 chars): %.500s", content)
             
-            content = response.choices[0].message.content.strip()
-            logger.info(f"📥 Raw LLM response (first 500 chars): {content[:500]}")
+            # Parse JSON
+            action_plan = parse_json_object(content)
+            if action_plan is None:
+                logger.error("❌ Could not parse JSON from response: %.200s", content)
+                raise ValueError(f"Could not parse JSON from response: {content[:200]}")
+            logger.info("✅ Successfully parsed action plan JSON")
             
-            # Extract JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
+            # The diagnostics below serialize the whole plan; skip building
+            # them entirely unless INFO records are actually emitted
+            log_details = logger.isEnabledFor(logging.INFO)
+            if log_details:
+                logger.info("Action plan keys: %s", list(action_plan.keys()))
             
-            # Parse JSON
-            try:
-                action_plan = json.loads(content)
-                logger.info(f"✅ Successfully parsed action plan JSON")
-                logger.info(f"Action plan keys: {list(action_plan.keys())}")
-                
-                # Log conditional_format if present
-                if "conditional_format" in action_plan:
-                    logger.info(f"✅ Conditional format found in action plan!")
-                    logger.info(f"Conditional format structure: {json.dumps(action_plan['conditional_format'], indent=2)}")
-                else:
-                    logger.warning(f"⚠️ No 'conditional_format' field in action plan!")
-                    logger.info(f"Full action plan structure: {json.dumps({k: type(v).__name__ for k, v in action_plan.items()}, indent=2)}")
-            except json.JSONDecodeError:
-                import re
-                json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
-                if json_match:
-                    action_plan = json.loads(json_match.group())
-                    logger.info(f"✅ Successfully parsed action plan JSON from regex extraction")
-                    logger.info(f"Action plan keys: {list(action_plan.keys())}")
-                    
-                    if "conditional_format" in action_plan:
-                        logger.info(f"✅ Conditional format found in action plan!")
-                        logger.info(f"Conditional format structure: {json.dumps(action_plan['conditional_format'], indent=2)}")
-                    else:
-                        logger.warning(f"⚠️ No 'conditional_format' field in action plan!")
-                else:
-                    logger.error(f"❌ Could not parse JSON from response: {content[:200]}")
-                    raise ValueError(f"Could not parse JSON from response: {content[:200]}")
+            # Log conditional_format if present
+            if "conditional_format" in action_plan:
+                if log_details:
+                    logger.info("✅ Conditional format found in action plan!")
+                    logger.info(
+                        "Conditional format structure: %s",
+                        json.dumps(action_plan["conditional_format"], indent=2),
+                    )
+            else:
+                logger.warning("⚠️ No 'conditional_format' field in action plan!")
+                if log_details:
+                    logger.info(
+                        "Full action plan structure: %s",
+                        json.dumps({k: type(v).__name__ for k, v in action_plan.items()}, indent=2),
+                    )
             
             # Normalize action plan
             ops_before = action_plan.get('operations', [])
-            logger.info(f"🔍 Action plan before normalization - operations count: {len(ops_before)}")
-            if ops_before:
-                logger.info(f"🔍 Operations before normalization: {json.dumps([{'description': op.get('description', 'No desc'), 'python_code': op.get('python_code', '')[:50]} for op in ops_before], indent=2)}")
+            if log_details:
+                logger.info("🔍 Action plan before normalization - operations count: %s", len(ops_before))
+                if ops_before:
+                    logger.info("🔍 Operations before normalization: %s", _operations_preview(ops_before))
             normalized_plan = self._normalize_action_plan(action_plan)
             ops_after = normalized_plan.get('operations', [])
-            logger.info(f"🔍 Action plan after normalization - operations count: {len(ops_after)}")
-            if ops_after:
-                logger.info(f"🔍 Operations after normalization: {json.dumps([{'description': op.get('description', 'No desc'), 'python_code': op.get('python_code', '')[:50]} for op in ops_after], indent=2)}")
+            if log_details:
+                logger.info("🔍 Action plan after normalization - operations count: %s", len(ops_after))
+                if ops_after:
+                    logger.info("🔍 Operations after normalization: %s", _operations_preview(ops_after))
             
-            prompt_tokens = getattr(response.usage, "prompt_tokens", 0) or 0
-            completion_tokens = getattr(response.usage, "completion_tokens", 0) or 0
             tokens_used = prompt_tokens + completion_tokens
             
-            logger.info(f"ActionPlanBot tokens: prompt={prompt_tokens}, completion={completion_tokens}, total={tokens_used}")
+            logger.info(
+                "ActionPlanBot tokens: prompt=%s (cached=%s), completion=%s, total=%s",
+                prompt_tokens, cached_tokens, completion_tokens, tokens_used,
+            )
             
             return {
                 "action_plan": normalized_plan,
-                "tokens_used": tokens_used
+                "tokens_used": tokens_used,
+                "cached_tokens": cached_tokens
             }
             
         except Exception as e:
             logger.error(f"ActionPlanBot failed: {str(e)}")
             raise RuntimeError(f"Action plan generation failed: {str(e)}")
     
-    def _normalize_action_plan(self, action_plan: Dict) -> Dict:
-        """Normalize and validate action plan structure"""
-        normalized = {
-            "operations": action_plan.get("operations", []),
-        }
+    def build_messages(
+        self,
+        user_prompt: str,
+        available_columns: List[str],
+        sample_data: Optional[List[Dict]] = None,
+        sample_explanation: Optional[str] = None
+    ) -> List[Dict]:
+        """
+        Build the chat messages for an action plan request
         
-        # Add optional fields - preserve ALL fields from action plan
-        if "add_row" in action_plan:
-            normalized["add_row"] = action_plan["add_row"]
+        Shared by generate_action_plan and the offline Batch API path, so both
+        send exactly the same prompt.
+        
+        Args:
+            user_prompt: User's request
+            available_columns: Available column names
+            sample_data: Sample data rows
+            sample_explanation: Explanation of sample data
+        
+        Returns:
+            System and user messages
+        """
+        # Extract total rows from sample_explanation if available
+        total_rows = None
+        if sample_explanation:
+            match = _ROWS_SELECTED_PATTERN.search(sample_explanation)
+            if match:
+                total_rows = int(match.group(2))
+        
+        # Build prompt with total row count
+        prompt = get_prompt_with_context(
+            user_prompt, available_columns, sample_data, total_rows=total_rows, include_system_prompt=False
+        )
+        
+        # Get task suggestions (simplified output)
+        task_suggestions = get_task_decision_guide(user_prompt)
+        task_hint = task_suggestions.get('suggested_task', 'auto-detect')
         
-        if "add_column" in action_plan:
-            normalized["add_column"] = action_plan["add_column"]
+        # Get column mapping info (Excel letters → actual column names) - simplified
+        column_mapping = get_column_mapping_info(available_columns)
         
-        if "delete_column" in action_plan:
-            normalized["delete_column"] = action_plan["delete_column"]
+        # Build concise prompt - remove verbose sections
+        # Only include essential context
+        prompt_parts = []
         
-        if "delete_rows" in action_plan:
-            normalized["delete_rows"] = action_plan["delete_rows"]
+        # Task hint (one line)
+        if task_hint != 'auto-detect':
+            prompt_parts.append(f"Task hint: {task_hint}")
         
-        if "sort" in action_plan:
-            normalized["sort"] = action_plan["sort"]
+        # Column mapping (essential for Excel letter references)
+        if column_mapping:
+            prompt_parts.append(column_mapping)
         
-        if "conditional_format" in action_plan:
-            normalized["conditional_format"] = action_plan["conditional_format"]
+        # Main prompt with sample data
+        prompt_parts.append(prompt)
         
-        if "format" in action_plan:
-            normalized["format"] = action_plan["format"]
+        # Build final prompt
+        full_prompt = "\n\n".join(prompt_parts) + "\n\nReturn ONLY valid JSON with operations array containing python_code for each operation."
         
-        if "filters" in action_plan:
-            normalized["filters"] = action_plan["filters"]
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": full_prompt}
+        ]
+    
+    def _normalize_action_plan(self, action_plan: Dict) -> Dict:
+        """Normalize and validate action plan structure"""
+        normalized = {
+            "operations": action_plan.get("operations", []),
+        }
         
-        if "task" in action_plan:
-            normalized["task"] = action_plan["task"]
+        # Add optional fields - preserve ALL fields from action plan
+        normalized.update(
+            {key: value for key, value in action_plan.items() if key in _PASSTHROUGH_PLAN_KEYS}
+        )
         
         # Ensure operations is a list
         if not isinstance(normalized["operations"], list):
@@ -946,14 +993,18 @@ class ActionPlanBot:
         
         # Validate and extract python_code for each operation
         for op in normalized["operations"]:
+            if not isinstance(op, dict):
+                continue
             # If python_code is missing or empty, try to extract from execution_instructions
-            if "python_code" not in op or not op.get("python_code", "").strip():
+            # (one lookup; a null python_code from the LLM counts as missing)
+            python_code = op.get("python_code")
+            if not isinstance(python_code, str) or not python_code.strip():
                 # Check if execution_instructions has code
-                exec_instructions = op.get("execution_instructions", {})
+                exec_instructions = op.get("execution_instructions")
                 if isinstance(exec_instructions, dict) and "code" in exec_instructions:
                     op["python_code"] = exec_instructions["code"]
                     logger.info(f"✅ Extracted python_code from execution_instructions.code")
-                elif "python_code" not in op:
+                elif python_code is None:
                     logger.warning(f"Operation missing python_code: {op}")
         
         return normalized
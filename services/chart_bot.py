@@ -5,20 +5,21 @@ Specialized bot for generating chart configurations.
 Handles all chart/visualization requests.
 """
 
-import json
 import os
 import logging
 import re
+from functools import cached_property
 from typing import Dict, List, Optional
 from openai import OpenAI
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).parent.parent))
+from services.embedding_service import EmbeddingService
 from services.feedback_learner import FeedbackLearner
+from services.llm_stream import create_openai_client, stream_json_completion
 from services.training_data_loader import TrainingDataLoader
+from utils.json_extract import json_dumps, parse_json_object
 from utils.knowledge_base import get_chart_knowledge_base_summary
 from utils.prompts import get_column_mapping_info, resolve_column_reference
 
@@ -57,17 +58,30 @@ EXAMPLES:
 Return ONLY valid JSON, no markdown or explanations.
 """
 
+# Chart types ChartBuilder can render; anything else falls back to "bar"
+_VALID_CHART_TYPES = frozenset({"bar", "line", "pie", "histogram", "scatter"})
+
+# Single-letter Excel column references ("chart A vs B")
+_EXCEL_COLUMN_REF_PATTERN = re.compile(r'\b([A-Z])\b')
+
 
 class ChartBot:
     """Bot for generating chart configurations"""
     
-    def __init__(self, api_key: Optional[str] = None, model: str = "gpt-4o-mini"):
+    def __init__(
+        self,
+        api_key: Optional[str] = None,
+        model: str = "gpt-4o-mini",
+        client: Optional[OpenAI] = None
+    ):
         """
         Initialize Chart Bot
         
         Args:
             api_key: OpenAI API key
             model: Model to use (default: gpt-4o-mini for cost savings, optimized for JSON outputs)
+            client: OpenAI client to share (e.g. LLMAgent's), so all bots reuse
+                one connection pool; a new one is created if omitted
         """
         self.api_key = api_key or os.getenv("OPENAI_API_KEY")
         if not self.api_key:
@@ -75,26 +89,48 @@ class ChartBot:
         
         # Use provided model directly (no env var override) since LLMAgent handles routing
         self.model = model
-        self.client = OpenAI(api_key=self.api_key)
+        self.client = client or create_openai_client(self.api_key)
         
-        # Initialize feedback learner
+        self.refresh_system_prompt()
+    
+    @cached_property
+    def feedback_learner(self) -> Optional[FeedbackLearner]:
+        """Feedback learner for few-shot examples, created on first use (None if unavailable)"""
         try:
-            self.feedback_learner = FeedbackLearner()
+            return FeedbackLearner()
         except Exception:
-            self.feedback_learner = None
-        
-        # Initialize training data loader
+            return None
+    
+    @cached_property
+    def training_data_loader(self) -> Optional[TrainingDataLoader]:
+        """Training data loader for few-shot examples, created on first use (None if unavailable)"""
         try:
-            self.training_data_loader = TrainingDataLoader()
+            return TrainingDataLoader()
         except Exception:
-            self.training_data_loader = None
+            return None
+    
+    def refresh_system_prompt(self):
+        """
+        (Re)build the system prompt from the current chart knowledge base
+        
+        The chart knowledge base is static, so it goes into the system
+        message: every request then shares an identical prefix that OpenAI
+        can serve from its prompt cache instead of re-processing it.
+        """
+        kb_summary = get_chart_knowledge_base_summary()
+        self.system_prompt = (
+            f"{CHART_BOT_SYSTEM_PROMPT}\nKNOWLEDGE BASE CONTEXT:\n{kb_summary}\n"
+            if kb_summary else CHART_BOT_SYSTEM_PROMPT
+        )
     
     def generate_chart_plan(
         self,
         user_prompt: str,
         available_columns: List[str],
         sample_data: Optional[List[Dict]] = None,
-        df: Optional[pd.DataFrame] = None
+        df: Optional[pd.DataFrame] = None,
+        prompt_embedding: Optional[np.ndarray] = None,
+        model: Optional[str] = None
     ) -> Dict:
         """
         Generate chart configuration
@@ -104,6 +140,9 @@ class ChartBot:
             available_columns: Available column names
             sample_data: Sample data rows
             df: DataFrame for data analysis (optional, needed for generic requests)
+            prompt_embedding: Precomputed embedding of user_prompt, shared by both
+                example retrievers instead of each encoding the prompt
+            model: Model for this call (defaults to the bot's model)
         
         Returns:
             Chart configuration dict (single chart) or dict with "charts" array (multiple charts)
@@ -118,23 +157,24 @@ class ChartBot:
             data_analysis = None
             if is_generic and df is not None:
                 data_analysis = self.analyze_data_for_charts(df, available_columns, sample_data)
-            # Get chart-specific knowledge base summary
-            kb_summary = get_chart_knowledge_base_summary()
-            
             # Get similar examples from training data and feedback
             similar_examples_text = ""
             all_examples = []
             
             if self.training_data_loader:
                 try:
-                    training_examples = self.training_data_loader.get_examples_for_prompt(user_prompt, limit=3)
+                    training_examples = self.training_data_loader.get_examples_for_prompt(
+                        user_prompt, limit=3, query_embedding=prompt_embedding
+                    )
                     all_examples.extend(training_examples)
                 except Exception:
                     pass
             
             if self.feedback_learner:
                 try:
-                    feedback_examples = self.feedback_learner.get_similar_successful_examples(user_prompt, limit=2)
+                    feedback_examples = self.feedback_learner.get_similar_successful_examples(
+                        user_prompt, limit=2, query_embedding=prompt_embedding
+                    )
                     for ex in feedback_examples:
                         all_examples.append({
                             "prompt": ex["prompt"],
@@ -144,20 +184,19 @@ class ChartBot:
                     pass
             
             if all_examples:
-                similar_examples_text = "\n\nFEW-SHOT LEARNING EXAMPLES:\n"
-                for i, ex in enumerate(all_examples[:5], 1):
-                    similar_examples_text += f"\nExample {i}:\n"
-                    similar_examples_text += f"User: {ex['prompt']}\n"
-                    chart_config = ex.get("chart_config", {})
-                    similar_examples_text += f"Response: {json.dumps(chart_config, indent=2)}\n"
+                all_examples = EmbeddingService().select_diverse_examples(all_examples, limit=3)
+                example_parts = ["\n\nFEW-SHOT LEARNING EXAMPLES:\n"]
+                for i, ex in enumerate(all_examples, 1):
+                    example_parts.append(f"\nExample {i}:\nUser: {ex['prompt']}\n")
+                    example_parts.append(f"Response: {json_dumps(ex.get('chart_config', {}))}\n")
+                similar_examples_text = "".join(example_parts)
             
             # Get column mapping info (Excel letters → actual column names)
             column_mapping = get_column_mapping_info(available_columns)
             
             # Enhance prompt to handle Excel column references in user request
             # Check if user mentions Excel column letters (A, B, C, etc.)
-            excel_ref_pattern = r'\b([A-Z])\b'
-            excel_refs = re.findall(excel_ref_pattern, user_prompt.upper())
+            excel_refs = _EXCEL_COLUMN_REF_PATTERN.findall(user_prompt.upper())
             if excel_refs and len(excel_refs) >= 2:
                 # User likely wants chart between Excel columns
                 # Add explicit instruction to resolve these
@@ -170,38 +209,27 @@ class ChartBot:
                 user_prompt, 
                 available_columns, 
                 sample_data, 
-                kb_summary, 
-                similar_examples_text, 
-                column_mapping,
+                similar_examples=similar_examples_text,
+                column_mapping=column_mapping,
                 data_analysis=data_analysis,
                 is_generic=is_generic
             )
             
-            response = self.client.chat.completions.create(
-                model=self.model,
+            # Streamed so parsing can start the moment the JSON object closes
+            content, prompt_tokens, completion_tokens, cached_tokens = stream_json_completion(
+                self.client,
+                model=model or self.model,
                 messages=[
-                    {"role": "system", "content": CHART_BOT_SYSTEM_PROMPT},
+                    {"role": "system", "content": self.system_prompt},
                     {"role": "user", "content": prompt}
                 ],
             )
-            
-            content = response.choices[0].message.content.strip()
-            
-            # Extract JSON
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
+            content = content.strip()
             
             # Parse JSON
-            try:
-                chart_config = json.loads(content)
-            except json.JSONDecodeError:
-                json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content, re.DOTALL)
-                if json_match:
-                    chart_config = json.loads(json_match.group())
-                else:
-                    raise ValueError(f"Could not parse JSON from response: {content[:200]}")
+            chart_config = parse_json_object(content)
+            if chart_config is None:
+                raise ValueError(f"Could not parse JSON from response: {content[:200]}")
             
             # Handle multiple charts (generic requests) or single chart
             if "charts" in chart_config and isinstance(chart_config["charts"], list):
@@ -215,15 +243,17 @@ class ChartBot:
                 # Single chart - validate normally
                 chart_config = self._validate_chart_config(chart_config, available_columns)
             
-            prompt_tokens = getattr(response.usage, "prompt_tokens", 0) or 0
-            completion_tokens = getattr(response.usage, "completion_tokens", 0) or 0
             tokens_used = prompt_tokens + completion_tokens
             
-            logger.info(f"ChartBot tokens: prompt={prompt_tokens}, completion={completion_tokens}, total={tokens_used}")
+            logger.info(
+                "ChartBot tokens: prompt=%s (cached=%s), completion=%s, total=%s",
+                prompt_tokens, cached_tokens, completion_tokens, tokens_used,
+            )
             
             return {
                 "chart_config": chart_config,
-                "tokens_used": tokens_used
+                "tokens_used": tokens_used,
+                "cached_tokens": cached_tokens
             }
             
         except Exception as e:
@@ -231,7 +261,7 @@ class ChartBot:
             raise RuntimeError(f"Chart configuration generation failed: {str(e)}")
     
     def _build_chart_prompt(self, user_prompt: str, columns: List[str], sample_data: Optional[List[Dict]], 
-                           kb_summary: str = "", similar_examples: str = "", column_mapping: str = "",
+                           similar_examples: str = "", column_mapping: str = "",
                            data_analysis: Optional[Dict] = None, is_generic: bool = False) -> str:
         """Build prompt for chart generation"""
         columns_info = f"Available columns: {', '.join(columns)}"
@@ -239,11 +269,12 @@ class ChartBot:
         sample_text = ""
         if sample_data:
             # Limit to 3 rows to reduce tokens
-            sample_text = "\n\nSample data (first 3 rows):\n"
+            sample_parts = ["\n\nSample data (first 3 rows):\n"]
             for i, row in enumerate(sample_data[:3], 1):
                 # Only include key columns to reduce token usage
                 sample_row = {k: v for k, v in list(row.items())[:5]}  # Max 5 columns per row
-                sample_text += f"Row {i}: {sample_row}\n"
+                sample_parts.append(f"Row {i}: {sample_row}\n")
+            sample_text = "".join(sample_parts)
         
         # Add data analysis for generic requests (condensed to reduce tokens)
         analysis_text = ""
@@ -252,18 +283,15 @@ class ChartBot:
             categorical = ', '.join(data_analysis.get('categorical_columns', [])[:5]) or 'None'
             datetime_cols = ', '.join(data_analysis.get('datetime_columns', [])[:3]) or 'None'
             
-            analysis_text = f"\nDATA ANALYSIS:\nNumeric: {numeric}\nCategorical: {categorical}\nDatetime: {datetime_cols}\n"
+            analysis_parts = [f"\nDATA ANALYSIS:\nNumeric: {numeric}\nCategorical: {categorical}\nDatetime: {datetime_cols}\n"]
             
             # Only include top 3 suggested charts to reduce tokens
             suggested = data_analysis.get('suggested_charts', [])[:3]
             if suggested:
-                analysis_text += "Suggested charts:\n"
+                analysis_parts.append("Suggested charts:\n")
                 for i, chart in enumerate(suggested, 1):
-                    analysis_text += f"{i}. {chart.get('chart_type', 'unknown')}: {chart.get('x_column', 'X')} vs {chart.get('y_column', 'Y')}\n"
-        
-        kb_context = ""
-        if kb_summary:
-            kb_context = f"\n\nKNOWLEDGE BASE CONTEXT:\n{kb_summary}\n"
+                    analysis_parts.append(f"{i}. {chart.get('chart_type', 'unknown')}: {chart.get('x_column', 'X')} vs {chart.get('y_column', 'Y')}\n")
+            analysis_text = "".join(analysis_parts)
         
         examples_context = ""
         if similar_examples:
@@ -273,8 +301,6 @@ class ChartBot:
         prompt_parts = []
         if analysis_text:
             prompt_parts.append(analysis_text.strip())
-        if kb_context:
-            prompt_parts.append(kb_context.strip())
         if examples_context:
             prompt_parts.append(examples_context.strip())
         if column_mapping:
@@ -296,8 +322,7 @@ class ChartBot:
         y_column = chart_config.get("y_column")
         
         # Validate chart type
-        valid_types = ["bar", "line", "pie", "histogram", "scatter"]
-        if chart_type not in valid_types:
+        if not isinstance(chart_type, str) or chart_type not in _VALID_CHART_TYPES:
             chart_type = "bar"  # Default
         
         # Validate columns - use column resolution (handles Excel letters)
@@ -6,7 +6,7 @@ Uses sentence-transformers for fast, local embeddings.
 """
 
 import logging
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 import numpy as np
 
 logger = logging.getLogger(__name__)
@@ -143,6 +143,62 @@ class EmbeddingService:
             logger.error(f"Error calculating similarity: {e}")
             return 0.0
     
+    def select_diverse_examples(
+        self,
+        examples: List[Dict],
+        limit: int = 3,
+        max_similarity: float = 0.9
+    ) -> List[Dict]:
+        """
+        Pick few-shot examples, skipping near-duplicates
+        
+        Examples are expected in relevance order. Each one is kept unless its
+        prompt is a repeat of, or within max_similarity of, an example already
+        kept, so the prompt doesn't pay for the same demonstration twice.
+        
+        Args:
+            examples: Example dicts with a "prompt" key (and optionally a
+                cached "embedding")
+            limit: Maximum number of examples to return
+            max_similarity: Cosine similarity above which an example counts as a duplicate
+            
+        Returns:
+            Up to limit examples, in their original order
+        """
+        # Exact repeats first (training data and feedback often overlap)
+        unique = []
+        seen_prompts = set()
+        for example in examples:
+            key = str(example.get("prompt", "")).strip().lower()
+            if key not in seen_prompts:
+                seen_prompts.add(key)
+                unique.append(example)
+        
+        if not self.model or len(unique) <= 1:
+            return unique[:limit]
+        
+        # Reuse cached embeddings; encode the rest in one batch
+        embeddings = [example.get("embedding") for example in unique]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = self.encode_batch([str(unique[i].get("prompt", "")) for i in missing])
+            for i, embedding in zip(missing, encoded):
+                embeddings[i] = embedding
+        
+        selected = []
+        kept_vectors = []
+        for example, embedding in zip(unique, embeddings):
+            if embedding is not None:
+                vector = np.asarray(embedding, dtype=np.float32)
+                vector = vector / (np.linalg.norm(vector) + 1e-8)
+                if any(float(np.dot(vector, kept)) > max_similarity for kept in kept_vectors):
+                    continue
+                kept_vectors.append(vector)
+            selected.append(example)
+            if len(selected) >= limit:
+                break
+        return selected
+    
     def find_most_similar(
         self, 
         query_embedding: np.ndarray, 
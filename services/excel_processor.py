@@ -30,6 +30,28 @@ from services.excel_preprocessor import ExcelPreprocessor
 from services.dataframe_normalizer import normalize_dataframe
 
 
+# Prompt wording that asks for conditional formatting/highlighting
+_CONDITIONAL_FORMAT_KEYWORDS = (
+    "highlight", "mark", "color", "colour", "flag", "shade",
+    "make it yellow", "bold cells", "format cells", "highlight cells", "highlight rows",
+    "paint", "background", "bg color", "background color"
+)
+
+# Color names recognised in prompts -> fill color (first match wins)
+_PROMPT_COLORS = (
+    ("green", "#90EE90"),  # Light green
+    ("yellow", "#FFFF00"),
+    ("red", "#FF0000"),
+    ("blue", "#0000FF"),
+    ("orange", "#FFA500"),
+    ("pink", "#FFC0CB"),
+    ("purple", "#800080"),
+    ("cyan", "#00FFFF"),
+    ("grey", "#808080"),
+    ("gray", "#808080"),
+)
+
+
 class ExcelProcessor:
     """Processes Excel/CSV files based on action plans"""
     
@@ -146,13 +168,8 @@ class ExcelProcessor:
         """Detect if user prompt asks for conditional formatting/highlighting."""
         if not prompt:
             return False
-        keywords = [
-            "highlight", "mark", "color", "colour", "flag", "shade",
-            "make it yellow", "bold cells", "format cells", "highlight cells", "highlight rows",
-            "paint", "background", "bg color", "background color"
-        ]
         prompt_lower = prompt.lower()
-        return any(keyword in prompt_lower for keyword in keywords)
+        return any(keyword in prompt_lower for keyword in _CONDITIONAL_FORMAT_KEYWORDS)
 
     def _extract_color_from_prompt(self, prompt: str) -> Optional[str]:
         """Extract color name from prompt and convert to hex code."""
@@ -160,20 +177,7 @@ class ExcelProcessor:
             return None
         prompt_lower = prompt.lower()
         
-        color_map = {
-            "green": "#90EE90",  # Light green
-            "yellow": "#FFFF00",
-            "red": "#FF0000",
-            "blue": "#0000FF",
-            "orange": "#FFA500",
-            "pink": "#FFC0CB",
-            "purple": "#800080",
-            "cyan": "#00FFFF",
-            "grey": "#808080",
-            "gray": "#808080",
-        }
-        
-        for color_name, hex_code in color_map.items():
+        for color_name, hex_code in _PROMPT_COLORS:
             if color_name in prompt_lower:
                 return hex_code
         
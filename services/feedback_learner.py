@@ -7,18 +7,33 @@ This enables the system to learn from real user interactions.
 
 import json
 import logging
+import os
+import threading
+import time
+from collections import OrderedDict
 from typing import Dict, List, Optional
 from datetime import datetime, timedelta
+import numpy as np
 
 from services.supabase_client import SupabaseClient
 from services.embedding_service import EmbeddingService
+from utils.json_extract import json_loads
 
 logger = logging.getLogger(__name__)
 
+# Recent successes fetched from Supabase are reused for this many seconds, or
+# until this process records a new success; other workers' inserts show up
+# once the entry expires
+_RECENT_SUCCESSES_TTL = float(os.getenv("FEEDBACK_CACHE_TTL", "300"))
+_PROMPT_EMBEDDINGS_SIZE = 1024
+
 
 class FeedbackLearner:
     """Learn from execution feedback to improve LLM responses"""
     
+    # Bumped on every recorded success; shared by all instances in the process
+    _success_version = 0
+    
     def __init__(self):
         """Initialize feedback learner with Supabase connection"""
         try:
@@ -30,6 +45,13 @@ class FeedbackLearner:
             logger.warning(f"Supabase not configured: {e}. Feedback learning will be disabled.")
             self.supabase = None
             self.embedding_service = None
+        
+        # fetch limit -> (success version, fetched at, rows)
+        self._recent_successes: Dict[int, tuple] = {}
+        # Example prompt text -> embedding; the same recent examples are
+        # scored on every request, so each is only encoded once
+        self._prompt_embeddings: OrderedDict = OrderedDict()
+        self._cache_lock = threading.Lock()
     
     def record_success(
         self, 
@@ -61,6 +83,7 @@ class FeedbackLearner:
                 "created_at": datetime.now().isoformat()
             }
             self.supabase.table(self.feedback_table).insert(feedback).execute()
+            FeedbackLearner._success_version += 1
             logger.info(f"Recorded successful execution for prompt: {user_prompt[:50]}...")
         except Exception as e:
             logger.error(f"Error recording success: {e}")
@@ -103,7 +126,8 @@ class FeedbackLearner:
         self, 
         user_prompt: str, 
         limit: int = 5,
-        use_semantic: bool = True
+        use_semantic: bool = True,
+        query_embedding: Optional[np.ndarray] = None
     ) -> List[Dict]:
         """
         Get similar successful examples for few-shot learning.
@@ -114,6 +138,8 @@ class FeedbackLearner:
             user_prompt: User's prompt to find similar examples for
             limit: Maximum number of examples to return
             use_semantic: Whether to use semantic search (True) or keyword search (False)
+            query_embedding: Precomputed embedding of user_prompt, so callers that
+                already embedded it (e.g. for caching) don't encode it again
             
         Returns:
             List of similar successful examples
@@ -123,51 +149,93 @@ class FeedbackLearner:
         
         try:
             # Get recent successful examples
-            result = self.supabase.table(self.feedback_table).select("*").eq(
-                "success", True
-            ).order("created_at", desc=True).limit(limit * 5).execute()
+            examples = self._get_recent_successes(limit * 5)
             
-            if not result.data:
+            if not examples:
                 return []
             
             # Use semantic search if available
             if use_semantic and self.embedding_service and self.embedding_service.is_available():
-                return self._semantic_search_feedback(user_prompt, result.data, limit)
+                return self._semantic_search_feedback(user_prompt, examples, limit, query_embedding)
             else:
-                return self._keyword_search_feedback(user_prompt, result.data, limit)
+                return self._keyword_search_feedback(user_prompt, examples, limit)
             
         except Exception as e:
             logger.error(f"Error getting similar examples: {e}")
             return []
     
+    def _get_recent_successes(self, fetch_limit: int) -> List[Dict]:
+        """
+        Most recent successful feedback rows, newest first
+        
+        Served from memory while no success has been recorded since the fetch
+        and the entry is younger than _RECENT_SUCCESSES_TTL, saving a Supabase
+        round trip on every request.
+        """
+        version = FeedbackLearner._success_version
+        now = time.monotonic()
+        with self._cache_lock:
+            cached = self._recent_successes.get(fetch_limit)
+        if cached is not None and cached[0] == version and now - cached[1] < _RECENT_SUCCESSES_TTL:
+            return cached[2]
+        
+        result = self.supabase.table(self.feedback_table).select("*").eq(
+            "success", True
+        ).order("created_at", desc=True).limit(fetch_limit).execute()
+        rows = result.data or []
+        with self._cache_lock:
+            self._recent_successes[fetch_limit] = (version, now, rows)
+        return rows
+    
+    def _encode_example_prompts(self, prompts: List[str]) -> List[Optional[np.ndarray]]:
+        """Embed example prompts, encoding only those not seen before (in one batch)"""
+        with self._cache_lock:
+            embeddings = [self._prompt_embeddings.get(prompt) for prompt in prompts]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        if missing:
+            encoded = self.embedding_service.encode_batch([prompts[i] for i in missing])
+            with self._cache_lock:
+                for i, embedding in zip(missing, encoded):
+                    embeddings[i] = embedding
+                    if embedding is not None:
+                        self._prompt_embeddings[prompts[i]] = embedding
+                        self._prompt_embeddings.move_to_end(prompts[i])
+                while len(self._prompt_embeddings) > _PROMPT_EMBEDDINGS_SIZE:
+                    self._prompt_embeddings.popitem(last=False)
+        return embeddings
+    
     def _semantic_search_feedback(
         self,
         user_prompt: str,
         examples: List[Dict],
-        limit: int
+        limit: int,
+        query_embedding: Optional[np.ndarray] = None
     ) -> List[Dict]:
         """Find similar examples using semantic search"""
         try:
-            # Generate embedding for user prompt
-            query_embedding = self.embedding_service.encode(user_prompt)
+            # Generate embedding for user prompt (unless the caller already did)
+            if query_embedding is None:
+                query_embedding = self.embedding_service.encode(user_prompt)
             if query_embedding is None:
                 return self._keyword_search_feedback(user_prompt, examples, limit)
             
-            # Generate embeddings for examples and find most similar
+            # Embed example prompts in one batched forward pass instead of one
+            # model call per example, reusing embeddings from earlier requests
+            examples = [example for example in examples if "user_prompt" in example]
+            embeddings = self._encode_example_prompts([example["user_prompt"] for example in examples])
+            
             candidate_embeddings = []
             example_data = []
             
-            for example in examples:
+            for example, embedding in zip(examples, embeddings):
                 try:
                     example_prompt = example["user_prompt"]
-                    # Generate embedding on-the-fly (could cache in future)
-                    embedding = self.embedding_service.encode(example_prompt)
                     
                     if embedding is not None:
                         candidate_embeddings.append((embedding, len(example_data)))
                         example_data.append({
                             "prompt": example_prompt,
-                            "action_plan": json.loads(example["action_plan"]),
+                            "action_plan": json_loads(example["action_plan"]),
                             "example": example
                         })
                 except (json.JSONDecodeError, Exception) as e:
@@ -217,7 +285,7 @@ class FeedbackLearner:
                 try:
                     similar.append({
                         "prompt": example["user_prompt"],
-                        "action_plan": json.loads(example["action_plan"]),
+                        "action_plan": json_loads(example["action_plan"]),
                         "similarity_score": len(common_words)
                     })
                 except json.JSONDecodeError:
@@ -262,7 +330,7 @@ class FeedbackLearner:
                 try:
                     error_patterns[error_key].append({
                         "prompt": failure["user_prompt"],
-                        "action_plan": json.loads(failure["action_plan"]),
+                        "action_plan": json_loads(failure["action_plan"]),
                         "full_error": error
                     })
                 except json.JSONDecodeError:
@@ -343,7 +411,7 @@ class FeedbackLearner:
                     try:
                         training_example = {
                             "prompt": example["user_prompt"],
-                            "response": json.loads(example["action_plan"])
+                            "response": json_loads(example["action_plan"])
                         }
                         f.write(json.dumps(training_example, ensure_ascii=False) + "\n")
                     except json.JSONDecodeError:
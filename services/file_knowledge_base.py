@@ -592,10 +592,10 @@ FILE INFORMATION:
 - Total columns: {len(df.columns)}
 
 COLUMN ANALYSIS:
-{json.dumps(column_analysis, indent=2, default=str)}
+{json.dumps(column_analysis, separators=(',', ':'), ensure_ascii=False, default=str)}
 
 SAMPLE DATA (representative rows):
-{json.dumps(sample_rows, indent=2, default=str)}
+{json.dumps(sample_rows, separators=(',', ':'), ensure_ascii=False, default=str)}
 
 YOUR TASK:
 Generate a concise, domain-agnostic summary (60-80 words) that describes:
@@ -9,11 +9,65 @@ The LLM returns detailed JSON with execution instructions, and this engine
 interprets and executes them dynamically.
 """
 
+import logging
 import pandas as pd
 import numpy as np
+from collections import deque
+from functools import lru_cache
+from types import CodeType
 from typing import Dict, List, Any, Optional
 from services.formula_engine import FormulaEngine
 
+logger = logging.getLogger(__name__)
+
+
+# Dispatch tables for LLM-provided method names. Resolved once at import and
+# doubling as an allow-list, so instructions can't reach arbitrary attributes.
+_PANDAS_METHODS = {
+    name: getattr(pd.DataFrame, name)
+    for name in (
+        "drop_duplicates", "fillna", "dropna", "ffill", "bfill", "replace",
+        "groupby", "merge", "pivot_table", "melt",
+        "sort_values", "sort_index", "nlargest", "nsmallest",
+        "rename", "drop", "assign", "query", "filter", "astype", "round",
+        "reset_index", "set_index", "head", "tail",
+        "sum", "mean", "median", "min", "max", "count", "nunique", "describe",
+    )
+}
+_FORMULA_METHODS = {
+    name: getattr(FormulaEngine, name)
+    for name in dir(FormulaEngine)
+    if not name.startswith("_") and callable(getattr(FormulaEngine, name))
+}
+
+
+@lru_cache(maxsize=256)
+def _compile_custom_code(custom_code: str) -> CodeType:
+    """
+    Compile LLM-provided custom code once per distinct source string.
+    
+    Cached plans replay the same snippets, so this skips re-parsing on every run.
+    """
+    return compile(custom_code, "<llm-custom>", "exec")
+
+
+def _is_fusable_query(operation: Dict) -> bool:
+    """
+    Check whether an operation is a plain row filter that can be ANDed with
+    its neighbours.
+    
+    Only bare pandas.query calls qualify. Expressions with calls or local
+    variable references are excluded, since e.g. ``x > x.mean()`` depends on
+    which rows earlier filters already removed.
+    """
+    instructions = operation.get("execution_instructions")
+    if not isinstance(instructions, dict) or instructions.get("method") != "pandas.query" or instructions.get("kwargs"):
+        return False
+    args = instructions.get("args")
+    if not isinstance(args, list) or len(args) != 1 or not isinstance(args[0], str):
+        return False
+    return "(" not in args[0] and "@" not in args[0]
+
 
 class GenericExecutor:
     """
@@ -27,13 +81,26 @@ class GenericExecutor:
         """
         Initialize executor with a dataframe.
         
+        The caller's DataFrame is not copied up front: most operations return
+        a new frame anyway. A private copy is taken lazily, right before the
+        first operation that could mutate the frame in place.
+        
         Args:
             df: DataFrame to operate on
         """
-        self.df = df.copy()
-        self.summary: List[str] = []
+        self.df = df
+        self._owns_df = False
+        # (op_type, description) pairs, formatted only when execute() returns;
+        # bounded so long pipelines can't grow it without limit
+        self.summary: deque = deque(maxlen=256)
         self.formula_result: Optional[Any] = None
     
+    def _ensure_owned(self):
+        """Copy the DataFrame once before any in-place mutation (copy-on-write)."""
+        if not self._owns_df:
+            self.df = self.df.copy()
+            self._owns_df = True
+    
     def execute(self, action_plan: Dict) -> Dict:
         """
         Execute an action plan from LLM.
@@ -55,17 +122,28 @@ class GenericExecutor:
         task = action_plan.get("task", "summarize")
         operations = action_plan.get("operations", [])
         
-        # If operations list is provided, execute them sequentially
+        # If operations list is provided, execute them sequentially; runs of
+        # plain row filters are fused into a single pass over the frame
         if operations:
+            run: List[Dict] = []
             for op in operations:
+                if _is_fusable_query(op):
+                    run.append(op)
+                    continue
+                self._execute_query_run(run)
+                run = []
                 self._execute_operation(op)
+            self._execute_query_run(run)
         else:
             # Fallback to task-based execution for backward compatibility
             self._execute_task(task, action_plan)
         
         return {
             "df": self.df,
-            "summary": self.summary,
+            "summary": [
+                description if description is not None else f"Executed {op_type}"
+                for op_type, description in self.summary
+            ],
             "chart_needed": action_plan.get("chart_type", "none") != "none",
             "chart_type": action_plan.get("chart_type", "none"),
             "formula_result": self.formula_result,
@@ -88,8 +166,7 @@ class GenericExecutor:
         }
         """
         op_type = operation.get("type")
-        params = operation.get("params", {})
-        instructions = operation.get("execution_instructions", {})
+        instructions = operation.get("execution_instructions")
         
         try:
             # Use execution instructions if provided (LLM-generated)
@@ -97,14 +174,39 @@ class GenericExecutor:
                 self._execute_by_instructions(instructions)
             else:
                 # Fallback to type-based execution
-                self._execute_by_type(op_type, params)
-            
-            # Add summary
-            description = operation.get("description", f"Executed {op_type}")
-            self.summary.append(description)
-            
+                self._execute_by_type(op_type, operation.get("params") or {})
         except Exception as e:
-            raise RuntimeError(f"Failed to execute operation {op_type}: {str(e)}")
+            raise RuntimeError(f"Failed to execute operation {op_type}: {e}") from e
+        
+        # Add summary
+        self.summary.append((op_type, operation.get("description")))
+    
+    def _execute_query_run(self, run: List[Dict]):
+        """
+        Execute consecutive row-filter operations as one combined query.
+        
+        Sequential filters each build a mask and materialize an intermediate
+        frame; ANDing the expressions scans the data once and copies the
+        surviving rows once. If the combined query fails, the filters are
+        replayed one by one so the error names the offending operation.
+        """
+        if len(run) < 2:
+            for op in run:
+                self._execute_operation(op)
+            return
+        
+        expression = " and ".join(
+            f"({op['execution_instructions']['args'][0]})" for op in run
+        )
+        try:
+            # query never mutates, so a failure leaves self.df untouched
+            self.df = self.df.query(expression)
+        except Exception:
+            for op in run:
+                self._execute_operation(op)
+            return
+        
+        self.summary.extend((op.get("type"), op.get("description")) for op in run)
     
     def _execute_by_instructions(self, instructions: Dict):
         """
@@ -120,30 +222,40 @@ class GenericExecutor:
         if method.startswith("pandas."):
             # Execute pandas method
             pandas_method = method.replace("pandas.", "")
-            if hasattr(pd.DataFrame, pandas_method):
-                func = getattr(self.df, pandas_method)
-                result = func(*args, **kwargs)
-                if isinstance(result, pd.DataFrame):
-                    self.df = result
-                elif result is not None:
-                    self.formula_result = result
+            func = _PANDAS_METHODS.get(pandas_method)
+            if func is None:
+                logger.warning("Skipping unsupported pandas method: %s", pandas_method)
+                return
+            if kwargs.get("inplace"):
+                self._ensure_owned()
+            result = func(self.df, *args, **kwargs)
+            # Not marked as owned: slicing methods (head, query, ...) may
+            # return frames that still share data with the caller's frame
+            if isinstance(result, pd.DataFrame):
+                self.df = result
+            elif result is not None:
+                self.formula_result = result
         elif method.startswith("formula."):
             # Execute formula engine method
             formula_method = method.replace("formula.", "")
-            if hasattr(FormulaEngine, formula_method):
-                func = getattr(FormulaEngine, formula_method)
-                result = func(self.df, *args, **kwargs)
-                if isinstance(result, pd.DataFrame):
-                    self.df = result
-                else:
-                    self.formula_result = result
+            func = _FORMULA_METHODS.get(formula_method)
+            if func is None:
+                logger.warning("Skipping unsupported formula method: %s", formula_method)
+                return
+            result = func(self.df, *args, **kwargs)
+            if isinstance(result, pd.DataFrame):
+                self.df = result
+                self._owns_df = True
+            else:
+                self.formula_result = result
         elif method == "custom":
             # Custom execution logic specified by LLM
             custom_code = instructions.get("code")
             if custom_code:
                 # Execute custom pandas operations
                 # Note: In production, you'd want to sandbox this
-                exec(custom_code, {"df": self.df, "pd": pd, "np": np})
+                self._ensure_owned()
+                exec(_compile_custom_code(custom_code), {"df": self.df, "pd": pd, "np": np})
     
     def _execute_by_type(self, op_type: str, params: Dict):
         """
@@ -155,11 +267,40 @@ class GenericExecutor:
             self.df = self.df.drop_duplicates()
         elif op_type == "fillna":
             value = params.get("value", "")
-            self.df = self.df.fillna(value)
+            float_values = self._float_values()
+            if float_values is not None and isinstance(value, (int, float)) and not isinstance(value, bool):
+                # Single float block: fill with one vectorized pass, skipping
+                # pandas' per-column fillna machinery
+                filled = np.where(np.isnan(float_values), value, float_values)
+                self.df = pd.DataFrame(filled, index=self.df.index, columns=self.df.columns, copy=False)
+                self._owns_df = True
+            else:
+                self.df = self.df.fillna(value)
         elif op_type == "dropna":
-            self.df = self.df.dropna()
+            float_values = self._float_values()
+            if float_values is not None:
+                self.df = self.df[~np.isnan(float_values).any(axis=1)]
+            else:
+                self.df = self.df.dropna()
         # Add more as needed, but ideally LLM should provide instructions
     
+    def _float_values(self) -> Optional[np.ndarray]:
+        """
+        Return the frame as a 2-D array if every column shares one float dtype.
+        
+        Such frames are a single block, so the array is obtained without a
+        per-column conversion. Returns None for mixed, non-float or nullable
+        (extension dtype) frames.
+        """
+        dtypes = set(self.df.dtypes)
+        if len(dtypes) != 1:
+            return None
+        # Plain numpy floats only: nullable Float64 converts to an object array
+        dtype = dtypes.pop()
+        if not isinstance(dtype, np.dtype) or dtype.kind != "f":
+            return None
+        return self.df.to_numpy()
+    
     def _execute_task(self, task: str, action_plan: Dict):
         """
         Fallback to task-based execution for backward compatibility.
@@ -5,23 +5,37 @@ Interprets user prompts and returns structured action plans using OpenAI GPT-4.1
 The LLM does NOT modify data directly - it only returns action plans.
 """
 
+import asyncio
+import copy
 import json
 import os
 import logging
+import re
+import sys
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from functools import cached_property
+from types import MappingProxyType
 from typing import Dict, List, Optional
-from openai import OpenAI
 from dotenv import load_dotenv
+import numpy as np
 import pandas as pd
 
-import sys
-from pathlib import Path
-sys.path.append(str(Path(__file__).parent.parent))
-from utils.prompts import get_prompt_with_context
-from utils.knowledge_base import get_knowledge_base_summary, get_task_decision_guide
+from utils.prompts import SYSTEM_PROMPT as PROMPT_RULES, get_prompt_with_context
+from utils.knowledge_base import (
+    get_chart_knowledge_base_summary, get_knowledge_base_summary, get_task_decision_guide
+)
+from services.embedding_service import EmbeddingService
 from services.feedback_learner import FeedbackLearner
 from services.training_data_loader import TrainingDataLoader
 from services.action_plan_bot import ActionPlanBot
 from services.chart_bot import ChartBot
+from services.llm_cache import (
+    CacheStore, ExactCache, SemanticCache, columns_signature, prompt_literals, sample_signature
+)
+from services.llm_stream import create_openai_client, stream_json_completion, usage_tokens
+from utils.json_extract import json_dumps, json_loads, parse_json_object
 
 load_dotenv()
 
@@ -85,6 +99,179 @@ SYSTEM_MESSAGE = (
     "The JSON must use actual column names from the provided dataset.\n"
 )
 
+LEGACY_PROMPT_INSTRUCTIONS = (
+    "CRITICAL: Provide detailed \"execution_instructions\" in the \"operations\" array for each operation.\n"
+    "This allows the system to execute your plan dynamically without hardcoded if-else statements.\n"
+    "Think step-by-step about how to execute the user's request using pandas operations or formula functions.\n"
+)
+
+_TASK_HINT_HEADER = "TASK DECISION HINT (use as guidance, not strict rule):\n"
+
+# Sample rows forwarded to the bots. SampleSelector picks at most 10; this
+# only bounds prompt size for callers that pass larger samples directly
+# (long cell values are already truncated when the prompt is built)
+_MAX_SAMPLE_ROWS = 20
+
+# Optional fields copied through by _normalize_action_plan
+_OPTIONAL_PLAN_KEYS = frozenset({
+    "filters", "group_by_column", "aggregate_function", "aggregate_column",
+    "delete_rows", "add_row", "add_column", "delete_column",
+    "edit_cell", "clear_cell", "auto_fill", "sort",
+    "format", "conditional_format", "formula",
+})
+
+_VALID_TASKS = frozenset({
+    "summarize", "clean", "group_by", "find_missing",
+    "filter", "combine_sheets", "generate_chart", "transform",
+    "delete_rows", "add_row", "add_column", "delete_column",
+    "edit_cell", "clear_cell", "auto_fill", "sort",
+    "format", "conditional_format", "formula",
+})
+
+_VALID_CHART_TYPES = frozenset({"bar", "line", "pie", "histogram", "scatter", "none"})
+
+# Substring match, like the keyword list it replaces: every multi-word chart
+# phrase ("bar chart", "scatter plot", ...) contains one of these words
+_CHART_KEYWORD_PATTERN = re.compile(
+    r"chart|graph|plot|visualize|histogram|scatter|dashboard"
+    r"|between|compare|relationship|correlation|bar|line|pie",
+    re.IGNORECASE
+)
+
+# Whole-prompt patterns with exactly one reading; these are answered with a
+# fixed plan (the same code ActionPlanBot's prompt teaches) without any LLM call
+_DEDUPE_PROMPT = re.compile(
+    r"(?:please\s+)?(?:(?:remove|delete|drop)\s+(?:all\s+)?(?:the\s+)?duplicates?(?:\s+rows?)?|dedupe|deduplicate)"
+)
+_DROP_EMPTY_ROWS_PROMPT = re.compile(
+    r"(?:please\s+)?(?:remove|delete|drop)\s+(?:all\s+)?(?:the\s+)?(?:empty|blank)\s+rows?"
+)
+_SORT_PROMPT = re.compile(
+    r"(?:please\s+)?sort\s+(?:the\s+)?(?:data\s+|rows\s+)?by\s+(?:column\s+)?(?P<column>.+?)"
+    r"(?:\s+(?P<order>asc|ascending|desc|descending))?"
+)
+
+
+# Complexity fast paths (matched against the lowercased prompt)
+_SIMPLE_COMMAND_PREFIXES = (
+    "delete column", "remove column", "rename column",
+    "clear cell", "make bold", "make italic",
+)
+# Explicit multi-step separators (" then " also covers " and then " and
+# ", then ") and very explicit complex formulas, in one scan
+_OBVIOUSLY_COMPLEX_PATTERN = re.compile(r" then | after that |vlookup|index match|nested formula")
+
+# Rubric for the LLM complexity fallback; the request is sent on its own
+_COMPLEXITY_SYSTEM_PROMPT = (
+    "Classify Excel operation requests. Respond: SIMPLE or COMPLEX only.\n"
+    "SIMPLE: Single operation (delete column, rename, add column, sort, filter, simple formula)\n"
+    "COMPLEX: Multiple steps OR complex formulas (vlookup, nested, multiple conditions)"
+)
+
+# Distinct prompts whose LLM complexity verdicts are remembered
+_LLM_COMPLEXITY_VERDICTS_SIZE = 1024
+
+# Labeled prompts for local complexity classification (True = complex, routed
+# to the full model); see _label_from_exemplars for how they're matched
+_COMPLEXITY_EXEMPLARS = (
+    ("delete column B", False),
+    ("rename column A to Customer Name", False),
+    ("sort by date descending", False),
+    ("filter rows where sales is greater than 1000", False),
+    ("remove duplicate rows", False),
+    ("fill empty cells with 0", False),
+    ("add a column with price times quantity", False),
+    ("make the header row bold", False),
+    ("highlight cells above 50 in red", False),
+    ("calculate the average of the revenue column", False),
+    ("create a bar chart of sales by region", False),
+    ("convert the date column to dd/mm/yyyy", False),
+    ("look up each product's price from the other sheet and add it as a column", True),
+    ("group by region, sum revenue, sort descending and keep the top 5", True),
+    ("clean the phone numbers, remove duplicates and sort by last name", True),
+    ("use an if formula with nested conditions to assign a grade to each score", True),
+    ("calculate month over month growth per product and flag any decline", True),
+    ("split full name into first and last name and merge them with the email list", True),
+    ("pivot sales by region and month with row and column totals", True),
+    ("highlight rows where status is late and amount is over 1000 or the date is missing", True),
+    ("find customers who bought in january but not in february", True),
+    ("compute a running total per category and the percentage of the grand total", True),
+)
+# A local verdict needs an exemplar at least this similar (MiniLM scores
+# unrelated requests around 0.2-0.4 and paraphrases well above 0.6) ...
+_COMPLEXITY_MIN_SIMILARITY = 0.55
+# ... and the best exemplar of one label must beat the best of the other by
+# this much; closer calls go to the LLM instead of a coin flip
+_COMPLEXITY_MIN_MARGIN = 0.08
+
+
+def _label_from_exemplars(scores: np.ndarray, labels: np.ndarray) -> Optional[bool]:
+    """
+    Decide complexity from exemplar similarities, or None if it's unclear
+    
+    Compares the best-matching complex exemplar with the best-matching simple
+    one. Returns None when neither is close enough or they are too close to
+    each other to call.
+    """
+    best_complex = float(scores[labels].max())
+    best_simple = float(scores[~labels].max())
+    if max(best_complex, best_simple) < _COMPLEXITY_MIN_SIMILARITY:
+        return None
+    if abs(best_complex - best_simple) < _COMPLEXITY_MIN_MARGIN:
+        return None
+    return best_complex > best_simple
+
+
+# Sample plans returned by get_example_action_plan (read-only table; the
+# method hands out deep copies)
+_EXAMPLE_ACTION_PLANS = MappingProxyType({
+    "group_by": {
+        "task": "group_by",
+        "columns_needed": ["Region", "Revenue"],
+        "chart_type": "bar",
+        "steps": [
+            "group_by Region sum Revenue",
+            "create_chart bar"
+        ],
+        "group_by_column": "Region",
+        "aggregate_function": "sum",
+        "aggregate_column": "Revenue"
+    },
+    "clean": {
+        "task": "clean",
+        "columns_needed": [],
+        "chart_type": "none",
+        "steps": [
+            "remove_duplicates",
+            "fix_formatting",
+            "handle_missing_values"
+        ]
+    },
+    "summarize": {
+        "task": "summarize",
+        "columns_needed": ["Sales", "Profit"],
+        "chart_type": "bar",
+        "steps": [
+            "calculate_statistics",
+            "create_summary_chart"
+        ]
+    },
+    "filter": {
+        "task": "filter",
+        "columns_needed": ["Date", "Amount"],
+        "chart_type": "line",
+        "steps": [
+            "filter Date >= 2024-01-01",
+            "create_chart line"
+        ],
+        "filters": {
+            "column": "Date",
+            "condition": ">=",
+            "value": "2024-01-01"
+        }
+    }
+})
+
 
 class LLMAgent:
     """Handles LLM interpretation of user prompts using OpenAI with hybrid model routing"""
@@ -106,35 +293,70 @@ class LLMAgent:
         self.complex_model = "gpt-4o"  # Use for complex operations
         
         try:
-            self.client = OpenAI(api_key=self.api_key)
+            self.client = create_openai_client(self.api_key)
         except Exception as e:
             raise ValueError(f"Failed to initialize OpenAI client: {str(e)}")
         
-        # Initialize feedback learner for continuous improvement
-        try:
-            self.feedback_learner = FeedbackLearner()
-        except Exception:
-            self.feedback_learner = None
-        
-        # Initialize training data loader for few-shot learning
-        try:
-            self.training_data_loader = TrainingDataLoader()
-        except Exception:
-            self.training_data_loader = None
-        
-        # Initialize specialized bots with both models for hybrid routing
-        # Mini bots (default for simple operations)
-        self.action_plan_bot_mini = ActionPlanBot(api_key=self.api_key, model=self.default_model)
-        self.chart_bot_mini = ChartBot(api_key=self.api_key, model=self.default_model)
+        # Reuse action plans for repeated prompts on the same column layout:
+        # exact matches first (no embedding needed), then paraphrases.
+        # Persisted across restarts when LLM_CACHE_DB points at a SQLite file.
+        cache_store = CacheStore.from_env()
+        self.exact_cache = ExactCache(
+            namespace=f"{self.default_model}|{self.complex_model}", store=cache_store
+        )
+        self.semantic_cache = SemanticCache(store=cache_store)
+        # Exact-cache key -> Future of the request currently computing it, so
+        # concurrent identical requests wait for one LLM call instead of each
+        # making their own. The Future holds the result, or None if that call
+        # failed, in which case each waiter tries for itself
+        self._inflight: Dict[tuple, Future] = {}
+        self._inflight_lock = threading.Lock()
+        # Normalized prompt -> LLM complexity verdict. The exact cache is keyed
+        # on the sample rows too, so the same request on another file would
+        # otherwise pay for classification again
+        self._llm_complexity_verdicts: OrderedDict = OrderedDict()
+        self._verdicts_lock = threading.Lock()
+        # Embedded complexity exemplars, set by _get_complexity_exemplars once
+        # embeddings are available
+        self._complexity_exemplars: Optional[tuple] = None
         
-        # Full bots (for complex operations)
-        self.action_plan_bot_full = ActionPlanBot(api_key=self.api_key, model=self.complex_model)
-        self.chart_bot_full = ChartBot(api_key=self.api_key, model=self.complex_model)
+        # Static prefix for the legacy path. Kept byte-identical across calls so
+        # OpenAI's automatic prompt caching (prefixes >= 1024 tokens) can reuse it;
+        # everything request-specific goes into the user message.
+        self._legacy_system_prompt = self._build_legacy_system_prompt()
         
         logger.info(f"🤖 LLMAgent initialized with hybrid model routing:")
         logger.info(f"   Default (simple): {self.default_model}")
         logger.info(f"   Complex: {self.complex_model}")
     
+    # Specialized bots, each created on first use so a worker only pays for
+    # the bots its requests actually route to. One instance per bot type
+    # serves both models (chosen per call), sharing its prompt, example
+    # retrievers and the agent's client.
+    @cached_property
+    def action_plan_bot(self) -> ActionPlanBot:
+        return ActionPlanBot(api_key=self.api_key, model=self.default_model, client=self.client)
+    
+    @cached_property
+    def chart_bot(self) -> ChartBot:
+        return ChartBot(api_key=self.api_key, model=self.default_model, client=self.client)
+    
+    @cached_property
+    def feedback_learner(self) -> Optional[FeedbackLearner]:
+        """Feedback learner for continuous improvement, created on first use (None if unavailable)"""
+        try:
+            return FeedbackLearner()
+        except Exception:
+            return None
+    
+    @cached_property
+    def training_data_loader(self) -> Optional[TrainingDataLoader]:
+        """Training data loader for few-shot learning, created on first use (None if unavailable)"""
+        try:
+            return TrainingDataLoader()
+        except Exception:
+            return None
+    
     def _is_chart_request(self, prompt: str) -> bool:
         """
         Detect if request is for chart generation
@@ -145,53 +367,32 @@ class LLMAgent:
         Returns:
             True if chart request, False otherwise
         """
-        prompt_lower = prompt.lower()
-        chart_keywords = [
-            "chart", "graph", "plot", "visualize", "visualization",
-            "bar chart", "bar graph", "line chart", "line graph",
-            "pie chart", "pie graph", "histogram",
-            "scatter plot", "scatter", "dashboard", "show chart",
-            "create chart", "create graph", "generate chart", "generate graph",
-            "make chart", "make graph", "draw chart", "draw graph",
-            "display chart", "display graph", "show graph",
-            # Additional patterns
-            "between", "compare", "relationship", "correlation",
-            # Chart type variations
-            "bar", "line", "pie", "scatter", "histogram"
-        ]
-        
-        # Check for explicit chart keywords
-        has_chart_keyword = any(keyword in prompt_lower for keyword in chart_keywords)
+        # Any chart keyword decides it; "between X and Y" phrasings are covered
+        # because "between" is itself a keyword
+        result = _CHART_KEYWORD_PATTERN.search(prompt) is not None
         
-        # Also check for patterns like "between X and Y" which often indicate chart requests
-        has_between_pattern = "between" in prompt_lower and ("and" in prompt_lower or "&" in prompt_lower)
-        
-        # Check for visualization intent words
-        visualization_intent = any(word in prompt_lower for word in [
-            "show", "display", "visualize", "compare", "relationship"
-        ])
-        
-        result = has_chart_keyword or (has_between_pattern and visualization_intent)
-        
-        logger.info(f"Chart detection: prompt='{prompt[:50]}...', has_keyword={has_chart_keyword}, has_between={has_between_pattern}, result={result}")
+        logger.info("Chart detection: prompt='%.50s...', result=%s", prompt, result)
         
         return result
     
     def _is_complex_operation(self, user_prompt: str, available_columns: List[str] = None, 
-                              sample_data: Optional[List[Dict]] = None) -> bool:
+                              sample_data: Optional[List[Dict]] = None,
+                              prompt_embedding: Optional[np.ndarray] = None) -> bool:
         """
-        Smart complexity detection - LLM-based with minimal token usage
+        Smart complexity detection - local first, LLM only as a last resort
         
         Strategy:
-        1. Fast path: Obvious simple/complex cases (no API call) - ~80% of requests
-        2. LLM path: Ambiguous cases (tiny API call ~60-80 tokens) - ~20% of requests
-        
-        Total token overhead: ~12-16 tokens per request on average (very low)
+        1. Fast path: Obvious simple/complex cases (keyword checks)
+        2. Local path: Labeled exemplars by embedding similarity, when one
+           label clearly wins
+        3. LLM path: Only if embeddings are unavailable or the exemplars are
+           inconclusive (tiny API call ~60-80 tokens)
         
         Args:
             user_prompt: User's request
             available_columns: Available column names (optional, for future use)
             sample_data: Sample data (optional, for future use)
+            prompt_embedding: Normalized prompt embedding, if already computed
             
         Returns:
             True if complex operation (use gpt-4o), False if simple (use gpt-4o-mini)
@@ -209,6 +410,13 @@ class LLMAgent:
         if self._is_obviously_complex(prompt_lower):
             return True
         
+        # Local path: one dot product against the labeled exemplars
+        if prompt_embedding is None:
+            prompt_embedding = self.semantic_cache.embed(user_prompt)
+        is_complex = self._classify_complexity_locally(prompt_embedding)
+        if is_complex is not None:
+            return is_complex
+        
         # LLM path: Everything else (tiny, cheap call)
         return self._llm_classify_complexity(user_prompt)
     
@@ -219,15 +427,7 @@ class LLMAgent:
         Returns True if operation is definitely simple (single, straightforward task)
         """
         # Very short, single-operation commands only
-        if len(prompt_lower.split()) <= 4:
-            simple_patterns = [
-                "delete column", "remove column", "rename column",
-                "clear cell", "make bold", "make italic"
-            ]
-            for pattern in simple_patterns:
-                if prompt_lower.startswith(pattern):
-                    return True
-        return False
+        return len(prompt_lower.split()) <= 4 and prompt_lower.startswith(_SIMPLE_COMMAND_PREFIXES)
     
     def _is_obviously_complex(self, prompt_lower: str) -> bool:
         """
@@ -235,15 +435,66 @@ class LLMAgent:
         
         Returns True if operation is definitely complex (multi-step, complex formulas, etc.)
         """
-        # Only explicit multi-step indicators
-        if any(sep in prompt_lower for sep in [" and then ", " then ", " after that ", ", then "]):
-            return True
+        # Only explicit multi-step indicators or very explicit complex formulas
+        return _OBVIOUSLY_COMPLEX_PATTERN.search(prompt_lower) is not None
+    
+    @staticmethod
+    def _build_legacy_system_prompt() -> str:
+        return (
+            f"{SYSTEM_MESSAGE}\n{LEGACY_PROMPT_INSTRUCTIONS}\n"
+            f"KNOWLEDGE BASE CONTEXT:\n{get_knowledge_base_summary()}\n"
+            f"{PROMPT_RULES}"
+        )
+    
+    def refresh_knowledge_base(self):
+        """
+        Pick up knowledge base changes made at runtime
         
-        # Only very explicit complex formulas
-        if any(kw in prompt_lower for kw in ["vlookup", "index match", "nested formula"]):
-            return True
+        The knowledge base summaries are memoized and baked into the system
+        prompts at startup; this drops the memoized summaries and rebuilds the
+        system prompts of the agent and both bots.
+        """
+        get_knowledge_base_summary.cache_clear()
+        get_chart_knowledge_base_summary.cache_clear()
+        self._legacy_system_prompt = self._build_legacy_system_prompt()
+        # Bots not created yet will build their prompts fresh on first use
+        for name in ("action_plan_bot", "chart_bot"):
+            bot = self.__dict__.get(name)
+            if bot is not None:
+                bot.refresh_system_prompt()
+    
+    def _get_complexity_exemplars(self) -> Optional[tuple]:
+        """
+        (normalized embedding matrix, is_complex labels) for the labeled
+        exemplars, embedded once on first success; None if embeddings are
+        unavailable, in which case a later call tries again
+        """
+        if self._complexity_exemplars is not None:
+            return self._complexity_exemplars
+        prompts = [prompt for prompt, _ in _COMPLEXITY_EXEMPLARS]
+        embeddings = [self.semantic_cache.embed(prompt) for prompt in prompts]
+        if any(embedding is None for embedding in embeddings):
+            return None
+        labels = np.array([is_complex for _, is_complex in _COMPLEXITY_EXEMPLARS])
+        self._complexity_exemplars = (np.vstack(embeddings), labels)
+        return self._complexity_exemplars
+    
+    def _classify_complexity_locally(self, prompt_embedding: Optional[np.ndarray]) -> Optional[bool]:
+        """
+        Label the prompt from its most similar exemplars
+        
+        Returns:
+            True/False for complex/simple, or None if there is no embedding or
+            the exemplars don't give a clear answer (see _label_from_exemplars)
+        """
+        if prompt_embedding is None:
+            return None
+        exemplars = self._get_complexity_exemplars()
+        if exemplars is None:
+            return None
         
-        return False
+        matrix, labels = exemplars
+        return _label_from_exemplars(matrix @ prompt_embedding, labels)
     
     def _llm_classify_complexity(self, user_prompt: str) -> bool:
         """
@@ -258,24 +509,20 @@ class LLMAgent:
         Returns:
             True if complex, False if simple
         """
+        verdict_key = " ".join(user_prompt.lower().split())
+        with self._verdicts_lock:
+            if verdict_key in self._llm_complexity_verdicts:
+                self._llm_complexity_verdicts.move_to_end(verdict_key)
+                return self._llm_complexity_verdicts[verdict_key]
+        
         try:
-            # Ultra-concise prompt (minimal tokens)
-            classification_prompt = f"""Classify: SIMPLE or COMPLEX
-
-SIMPLE: Single operation (delete column, rename, add column, sort, filter, simple formula)
-COMPLEX: Multiple steps OR complex formulas (vlookup, nested, multiple conditions)
-
-Request: "{user_prompt}"
-Answer:"""
-
+            # Static rubric in the system message, request alone as the user
+            # message: the prefix is byte-identical across calls
             response = self.client.chat.completions.create(
                 model="gpt-4o-mini",  # Use cheapest model for classification
                 messages=[
-                    {
-                        "role": "system", 
-                        "content": "Classify Excel operations. Respond: SIMPLE or COMPLEX only."
-                    },
-                    {"role": "user", "content": classification_prompt}
+                    {"role": "system", "content": _COMPLEXITY_SYSTEM_PROMPT},
+                    {"role": "user", "content": user_prompt}
                 ],
                 max_completion_tokens=5  # Just "SIMPLE" or "COMPLEX"
             )
@@ -283,9 +530,15 @@ Answer:"""
             result = response.choices[0].message.content.strip().upper()
             is_complex = "COMPLEX" in result
             
-            tokens_used = response.usage.total_tokens if hasattr(response, 'usage') else 0
+            # response.usage may be None: a hasattr check passes and the
+            # attribute access would then raise, discarding a valid answer
+            tokens_used = sum(usage_tokens(response.usage))
             logger.info(f"🔍 LLM classification: '{user_prompt[:40]}...' → {result} ({tokens_used} tokens)")
             
+            with self._verdicts_lock:
+                self._llm_complexity_verdicts[verdict_key] = is_complex
+                if len(self._llm_complexity_verdicts) > _LLM_COMPLEXITY_VERDICTS_SIZE:
+                    self._llm_complexity_verdicts.popitem(last=False)
             return is_complex
             
         except Exception as e:
@@ -312,24 +565,410 @@ Answer:"""
         Uses hybrid model routing:
         - gpt-4o-mini: For simple operations (default, cost-effective, optimized for structured outputs)
         - gpt-4o: For complex operations (better accuracy, optimized for JSON/schema outputs)
+        
+        Results are cached by exact prompt, column layout and sample rows, and
+        by prompt similarity and column layout; cache hits skip the LLM
+        entirely and report zero tokens used. An identical request arriving
+        while one is still in flight waits for that result rather than
+        calling the LLM again.
+        """
+        if sample_data and len(sample_data) > _MAX_SAMPLE_ROWS:
+            sample_data = sample_data[:_MAX_SAMPLE_ROWS]
+        
+        columns_key = columns_signature(available_columns)
+        sample_key = sample_signature(sample_data)
+        cached = self.exact_cache.get(user_prompt, columns_key, sample_key)
+        if cached is not None:
+            cached["tokens_used"] = cached["cached_tokens"] = 0
+            return cached
+        
+        local_plan = self._build_local_plan(user_prompt, available_columns)
+        if local_plan is not None:
+            logger.info(f"Answered locally without LLM: {local_plan['operations'][0]['description']}")
+            return {"action_plan": local_plan, "tokens_used": 0, "cached_tokens": 0}
+        
+        flight_key = (user_prompt, columns_key, sample_key)
+        with self._inflight_lock:
+            leader = self._inflight.get(flight_key)
+            if leader is None:
+                self._inflight[flight_key] = flight = Future()
+        
+        if leader is not None:
+            # The leader's result is normally in the exact cache by now
+            leader_result = leader.result()
+            if leader_result is not None:
+                cached = self.exact_cache.get(user_prompt, columns_key, sample_key)
+                if cached is None:
+                    cached = copy.deepcopy(leader_result)
+                cached["tokens_used"] = cached["cached_tokens"] = 0
+                return cached
+            # The leader failed (possibly a transient API error): make our own
+            # attempt rather than sharing its exception
+            return self._interpret_cache_miss(
+                user_prompt, available_columns, sample_data, sample_explanation, df,
+                columns_key, sample_key
+            )
+        
+        result = None
+        try:
+            result = self._interpret_cache_miss(
+                user_prompt, available_columns, sample_data, sample_explanation, df,
+                columns_key, sample_key
+            )
+            return result
+        finally:
+            # None tells waiting followers to retry on their own
+            flight.set_result(result)
+            with self._inflight_lock:
+                del self._inflight[flight_key]
+    
+    def _interpret_cache_miss(
+        self,
+        user_prompt: str,
+        available_columns: List[str],
+        sample_data: Optional[List[Dict]],
+        sample_explanation: Optional[str],
+        df: Optional[pd.DataFrame],
+        columns_key: tuple,
+        sample_key: str
+    ) -> Dict:
+        """Semantic cache lookup, then routing to a bot; stores fresh results in both caches"""
+        prompt_embedding = self.semantic_cache.embed(user_prompt)
+        literals = prompt_literals(user_prompt, available_columns)
+        cached = self.semantic_cache.get(prompt_embedding, columns_key, literals, sample_key)
+        if cached is not None:
+            self.exact_cache.put(user_prompt, columns_key, cached, sample_key)
+            cached["tokens_used"] = cached["cached_tokens"] = 0
+            return cached
+        
+        result = self._route_prompt(
+            user_prompt=user_prompt,
+            available_columns=available_columns,
+            sample_data=sample_data,
+            sample_explanation=sample_explanation,
+            df=df,
+            prompt_embedding=prompt_embedding
+        )
+        self.exact_cache.put(user_prompt, columns_key, result, sample_key)
+        self.semantic_cache.put(prompt_embedding, columns_key, result, literals, sample_key)
+        return result
+    
+    async def ainterpret_prompt(
+        self,
+        user_prompt: str,
+        available_columns: List[str],
+        user_id: Optional[str] = None,
+        sample_data: Optional[List[Dict]] = None,
+        sample_explanation: Optional[str] = None,
+        df: Optional[pd.DataFrame] = None
+    ) -> Dict:
+        """
+        Async variant of interpret_prompt for the FastAPI endpoints
+        
+        The OpenAI calls block for seconds; running them in a worker thread
+        keeps the event loop free to serve other requests meanwhile.
+        """
+        return await asyncio.to_thread(
+            self.interpret_prompt,
+            user_prompt,
+            available_columns,
+            user_id=user_id,
+            sample_data=sample_data,
+            sample_explanation=sample_explanation,
+            df=df
+        )
+    
+    def interpret_prompts_batch(
+        self,
+        user_prompts: List[str],
+        available_columns: List[str],
+        user_id: Optional[str] = None,
+        sample_data: Optional[List[Dict]] = None,
+        sample_explanation: Optional[str] = None,
+        df: Optional[pd.DataFrame] = None,
+        max_workers: int = 8
+    ) -> List[Dict]:
+        """
+        Interpret several prompts against the same sheet
+        
+        Duplicate prompts are interpreted once, and the distinct ones run
+        concurrently so the batch costs roughly one round-trip of latency
+        instead of one per prompt. Each prompt still goes through
+        interpret_prompt, so routing, model selection and caching are unchanged.
+        
+        Args:
+            user_prompts: Prompts to interpret
+            available_columns: Column names shared by all prompts
+            max_workers: Maximum prompts in flight at once; keeps large batches
+                under the account's OpenAI rate limits
+            
+        Returns:
+            Results in the same order as user_prompts. Duplicates get their own
+            copy and only the first occurrence reports tokens used.
+        """
+        unique_prompts = list(dict.fromkeys(user_prompts))
+        if not unique_prompts:
+            return []
+        
+        workers = max(1, min(len(unique_prompts), max_workers))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="llm-batch") as pool:
+            futures = {
+                prompt: pool.submit(
+                    self.interpret_prompt,
+                    prompt, available_columns, user_id, sample_data, sample_explanation, df
+                )
+                for prompt in unique_prompts
+            }
+            resolved = {prompt: future.result() for prompt, future in futures.items()}
+        
+        return self._expand_batch_results(user_prompts, resolved)
+    
+    async def ainterpret_prompts_batch(
+        self,
+        user_prompts: List[str],
+        available_columns: List[str],
+        user_id: Optional[str] = None,
+        sample_data: Optional[List[Dict]] = None,
+        sample_explanation: Optional[str] = None,
+        df: Optional[pd.DataFrame] = None,
+        max_concurrent: int = 8
+    ) -> List[Dict]:
+        """
+        Async variant of interpret_prompts_batch for the FastAPI endpoints
+        
+        Distinct prompts are interpreted concurrently, at most max_concurrent
+        at a time so a large batch can't blow through the OpenAI rate limits.
+        Rate-limited (429) calls are retried with exponential backoff by the
+        OpenAI client itself.
+        
+        Args:
+            user_prompts: Prompts to interpret
+            available_columns: Column names shared by all prompts
+            max_concurrent: Maximum number of prompts in flight at once
+            
+        Returns:
+            Results in the same order as user_prompts (see interpret_prompts_batch)
+        """
+        unique_prompts = list(dict.fromkeys(user_prompts))
+        if not unique_prompts:
+            return []
+        
+        semaphore = asyncio.Semaphore(max_concurrent)
+        
+        async def interpret(prompt: str) -> Dict:
+            async with semaphore:
+                return await self.ainterpret_prompt(
+                    prompt,
+                    available_columns,
+                    user_id=user_id,
+                    sample_data=sample_data,
+                    sample_explanation=sample_explanation,
+                    df=df
+                )
+        
+        results = await asyncio.gather(*(interpret(prompt) for prompt in unique_prompts))
+        return self._expand_batch_results(user_prompts, dict(zip(unique_prompts, results)))
+    
+    @staticmethod
+    def _expand_batch_results(user_prompts: List[str], resolved: Dict[str, Dict]) -> List[Dict]:
+        """Map per-prompt results back onto the batch order, one copy per duplicate"""
+        results = []
+        seen = set()
+        for prompt in user_prompts:
+            if prompt in seen:
+                result = copy.deepcopy(resolved[prompt])
+                result["tokens_used"] = result["cached_tokens"] = 0
+            else:
+                result = resolved[prompt]
+                seen.add(prompt)
+            results.append(result)
+        return results
+    
+    def submit_batch(
+        self,
+        user_prompts: List[str],
+        available_columns: List[str],
+        sample_data: Optional[List[Dict]] = None,
+        sample_explanation: Optional[str] = None,
+        use_complex_model: bool = False
+    ) -> str:
+        """
+        Queue prompts on the OpenAI Batch API for offline interpretation
+        
+        For non-interactive jobs (backfills, regenerating training data) only:
+        batches cost half as much and don't count against the per-minute rate
+        limits, but may take up to 24 hours. Results are collected with
+        poll_batch. Chart routing, complexity classification and the caches
+        are not applied; every prompt goes to ActionPlanBot.
+        
+        Args:
+            user_prompts: Prompts to interpret
+            available_columns: Column names shared by all prompts
+            use_complex_model: Use the full model instead of the default one
+            
+        Returns:
+            Batch ID to pass to poll_batch
+        """
+        bot = self.action_plan_bot
+        model = self.complex_model if use_complex_model else self.default_model
+        if sample_data and len(sample_data) > _MAX_SAMPLE_ROWS:
+            sample_data = sample_data[:_MAX_SAMPLE_ROWS]
+        lines = [
+            json_dumps({
+                # Output order isn't guaranteed; the index restores it
+                "custom_id": f"prompt-{index}",
+                "method": "POST",
+                "url": "/v1/chat/completions",
+                "body": {
+                    "model": model,
+                    "messages": bot.build_messages(prompt, available_columns, sample_data, sample_explanation),
+                    "response_format": {"type": "json_object"},
+                },
+            })
+            for index, prompt in enumerate(user_prompts)
+        ]
+        batch_file = self.client.files.create(
+            file=("action_plans.jsonl", "\n".join(lines).encode("utf-8")),
+            purpose="batch"
+        )
+        batch = self.client.batches.create(
+            input_file_id=batch_file.id,
+            endpoint="/v1/chat/completions",
+            completion_window="24h",
+            metadata={"prompt_count": str(len(user_prompts))}
+        )
+        logger.info(f"Submitted batch {batch.id} with {len(user_prompts)} prompts")
+        return batch.id
+    
+    def poll_batch(self, batch_id: str) -> Optional[List[Dict]]:
+        """
+        Collect the results of a batch submitted with submit_batch
+        
+        Args:
+            batch_id: ID returned by submit_batch
+            
+        Returns:
+            None while the batch is still running, else one entry per submitted
+            prompt in submission order: {"action_plan", "tokens_used"} on
+            success or {"error": message} for prompts that failed
+            
+        Raises:
+            RuntimeError: If the batch failed, expired or was cancelled
+        """
+        batch = self.client.batches.retrieve(batch_id)
+        if batch.status in ("failed", "expired", "cancelled"):
+            raise RuntimeError(f"Batch {batch_id} {batch.status}")
+        if batch.status != "completed":
+            return None
+        
+        prompt_count = int((batch.metadata or {}).get("prompt_count", batch.request_counts.total))
+        results: List[Dict] = [{"error": "No result returned"} for _ in range(prompt_count)]
+        
+        for file_id in (batch.output_file_id, batch.error_file_id):
+            if not file_id:
+                continue
+            for line in self.client.files.content(file_id).text.splitlines():
+                if not line.strip():
+                    continue
+                row = json_loads(line)
+                index = int(row["custom_id"].rsplit("-", 1)[1])
+                results[index] = self._parse_batch_row(row)
+        return results
+    
+    def _parse_batch_row(self, row: Dict) -> Dict:
+        """Turn one Batch API output line into an interpret_prompt-style result"""
+        response = row.get("response") or {}
+        body = response.get("body") or {}
+        if row.get("error") or response.get("status_code") != 200:
+            error = row.get("error") or body.get("error") or {}
+            return {"error": error.get("message", "Request failed") if isinstance(error, dict) else str(error)}
+        
+        content = body["choices"][0]["message"]["content"] or ""
+        action_plan = parse_json_object(content)
+        if action_plan is None:
+            return {"error": f"Could not parse JSON from response: {content[:200]}"}
+        
+        usage = body.get("usage") or {}
+        return {
+            "action_plan": self.action_plan_bot._normalize_action_plan(action_plan),
+            "tokens_used": (usage.get("prompt_tokens") or 0) + (usage.get("completion_tokens") or 0),
+            "cached_tokens": (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+        }
+    
+    def _build_local_plan(self, user_prompt: str, available_columns: List[str]) -> Optional[Dict]:
+        """
+        Build the plan for trivially unambiguous prompts without calling the LLM
+        
+        Only whole-prompt matches qualify ("remove duplicates", "sort by Age desc"
+        where Age is an actual column); anything with extra wording goes to the LLM.
+        
+        Returns:
+            Action plan in ActionPlanBot's format, or None
+        """
+        text = user_prompt.strip().rstrip(".!").strip().lower()
+        
+        if _DEDUPE_PROMPT.fullmatch(text):
+            code, description = "df = df.drop_duplicates().reset_index(drop=True)", "Remove duplicate rows"
+        elif _DROP_EMPTY_ROWS_PROMPT.fullmatch(text):
+            code, description = "df = df.dropna(how='all').reset_index(drop=True)", "Remove empty rows"
+        else:
+            match = _SORT_PROMPT.fullmatch(text)
+            if not match:
+                return None
+            wanted = match.group("column").strip().strip("'\"")
+            column = next((col for col in available_columns if str(col).lower() == wanted), None)
+            # repr() must round-trip as a Python literal in the generated code
+            if not isinstance(column, (str, int)):
+                return None
+            ascending = not (match.group("order") or "asc").startswith("desc")
+            code = f"df = df.sort_values(by={column!r}, ascending={ascending}).reset_index(drop=True)"
+            description = f"Sort rows by {column} ({'ascending' if ascending else 'descending'})"
+        
+        return {
+            "operations": [{
+                "python_code": code,
+                "description": description,
+                "result_type": "dataframe"
+            }]
+        }
+    
+    def _route_prompt(
+        self,
+        user_prompt: str,
+        available_columns: List[str],
+        sample_data: Optional[List[Dict]] = None,
+        sample_explanation: Optional[str] = None,
+        df: Optional[pd.DataFrame] = None,
+        prompt_embedding: Optional[np.ndarray] = None
+    ) -> Dict:
+        """
+        Route prompt to ChartBot or ActionPlanBot (uncached)
+        
+        Args:
+            prompt_embedding: Prompt embedding already computed for the semantic
+                cache, reused for complexity detection and few-shot example retrieval
         """
         # Check if chart request
         is_chart = self._is_chart_request(user_prompt)
         
-        # Detect complexity (ultra-lightweight, runs before any heavy operations)
-        is_complex = self._is_complex_operation(user_prompt, available_columns, sample_data)
+        # Detect complexity. Runs sequentially after the semantic-cache miss and
+        # reuses its prompt embedding, so only the LLM fallback costs a round-trip
+        is_complex = self._is_complex_operation(
+            user_prompt, available_columns, sample_data, prompt_embedding=prompt_embedding
+        )
         
         if is_chart:
             # Route to ChartBot with appropriate model
-            chart_bot = self.chart_bot_full if is_complex else self.chart_bot_mini
             model_used = self.complex_model if is_complex else self.default_model
-            logger.info(f"📊 Routing to ChartBot ({model_used}) - Complex: {is_complex}")
+            logger.info("📊 Routing to ChartBot (%s) - Complex: %s", model_used, is_complex)
             
-            result = chart_bot.generate_chart_plan(
+            result = self.chart_bot.generate_chart_plan(
                 user_prompt=user_prompt,
                 available_columns=available_columns,
                 sample_data=sample_data,
-                df=df  # Pass DataFrame for data analysis
+                df=df,  # Pass DataFrame for data analysis
+                prompt_embedding=prompt_embedding,
+                model=model_used
             )
             # Handle multiple charts (generic requests) or single chart
             chart_config = result["chart_config"]
@@ -340,7 +979,8 @@ Answer:"""
                         "task": "chart",
                         "chart_configs": chart_config["charts"]  # Array of charts
                     },
-                    "tokens_used": result.get("tokens_used", 0)
+                    "tokens_used": result.get("tokens_used", 0),
+                    "cached_tokens": result.get("cached_tokens", 0)
                 }
             else:
                 # Single chart - return single config
@@ -349,24 +989,29 @@ Answer:"""
                         "task": "chart",
                         "chart_config": chart_config  # Single chart
                     },
-                    "tokens_used": result.get("tokens_used", 0)
+                    "tokens_used": result.get("tokens_used", 0),
+                    "cached_tokens": result.get("cached_tokens", 0)
                 }
         else:
             # Route to ActionPlanBot with appropriate model
-            action_bot = self.action_plan_bot_full if is_complex else self.action_plan_bot_mini
             model_used = self.complex_model if is_complex else self.default_model
-            logger.info(f"🔄 Routing to ActionPlanBot ({model_used}) - Complex: {is_complex}")
-            logger.info(f"📝 User prompt: {user_prompt}")
+            logger.info("🔄 Routing to ActionPlanBot (%s) - Complex: %s", model_used, is_complex)
+            logger.info("📝 User prompt: %s", user_prompt)
             
-            result = action_bot.generate_action_plan(
+            result = self.action_plan_bot.generate_action_plan(
                 user_prompt=user_prompt,
                 available_columns=available_columns,
                 sample_data=sample_data,
-                sample_explanation=sample_explanation
+                sample_explanation=sample_explanation,
+                model=model_used
+            )
+            # %s arguments are only formatted when INFO is enabled
+            logger.info(
+                "📤 ActionPlanBot returned action plan with keys: %s",
+                list(result) if isinstance(result, dict) else "Not a dict",
             )
-            logger.info(f"📤 ActionPlanBot returned action plan with keys: {list(result.keys()) if isinstance(result, dict) else 'Not a dict'}")
             if isinstance(result, dict) and "conditional_format" in result:
-                logger.info(f"✅ Conditional format in result: {result['conditional_format']}")
+                logger.info("✅ Conditional format in result: %s", result["conditional_format"])
             return result
     
     def _legacy_interpret_prompt(
@@ -381,10 +1026,7 @@ Answer:"""
         Legacy method - kept for backward compatibility
         """
         try:
-            prompt = get_prompt_with_context(user_prompt, available_columns, sample_data)
-            
-            # Get knowledge base summary for enhanced context
-            kb_summary = get_knowledge_base_summary()
+            prompt = get_prompt_with_context(user_prompt, available_columns, sample_data, include_system_prompt=False)
             
             # Get task decision suggestions (for validation, not enforcement)
             task_suggestions = get_task_decision_guide(user_prompt)
@@ -393,16 +1035,23 @@ Answer:"""
             similar_examples_text = ""
             all_examples = []
             
+            # Embed the prompt once for both example retrievers
+            prompt_embedding = self.semantic_cache.embed(user_prompt)
+            
             if self.training_data_loader:
                 try:
-                    training_examples = self.training_data_loader.get_examples_for_prompt(user_prompt, limit=3)
+                    training_examples = self.training_data_loader.get_examples_for_prompt(
+                        user_prompt, limit=3, query_embedding=prompt_embedding
+                    )
                     all_examples.extend(training_examples)
                 except Exception:
                     pass
             
             if self.feedback_learner:
                 try:
-                    feedback_examples = self.feedback_learner.get_similar_successful_examples(user_prompt, limit=2)
+                    feedback_examples = self.feedback_learner.get_similar_successful_examples(
+                        user_prompt, limit=2, query_embedding=prompt_embedding
+                    )
                     for ex in feedback_examples:
                         all_examples.append({
                             "prompt": ex["prompt"],
@@ -412,80 +1061,62 @@ Answer:"""
                     pass
             
             if all_examples:
-                similar_examples_text = "\n\nFEW-SHOT LEARNING EXAMPLES (from training data and past executions):\n"
-                for i, ex in enumerate(all_examples[:5], 1):
-                    similar_examples_text += f"\nExample {i}:\n"
-                    similar_examples_text += f"User: {ex['prompt']}\n"
-                    similar_examples_text += f"Response: {json.dumps(ex['action_plan'], indent=2)}\n"
+                all_examples = EmbeddingService().select_diverse_examples(all_examples, limit=3)
+                example_parts = ["FEW-SHOT LEARNING EXAMPLES (from training data and past executions):\n"]
+                for i, ex in enumerate(all_examples, 1):
+                    example_parts.append(f"\nExample {i}:\nUser: {ex['prompt']}\n")
+                    example_parts.append(f"Response: {json_dumps(ex['action_plan'])}\n")
                     if ex.get('execution_instructions'):
-                        similar_examples_text += f"Execution: {ex['execution_instructions']}\n"
+                        example_parts.append(f"Execution: {ex['execution_instructions']}\n")
+                similar_examples_text = "".join(example_parts)
             
             sample_explanation_text = ""
             if sample_explanation:
                 sample_explanation_text = f"\n\nDATA SAMPLE SUMMARY:\n{sample_explanation}\n"
             
-            full_prompt = f"""You are a data analysis assistant that returns ONLY valid JSON. 
-Do not include any markdown formatting, code blocks, or explanatory text. Return pure JSON only.
-
-CRITICAL: Provide detailed "execution_instructions" in the "operations" array for each operation.
-This allows the system to execute your plan dynamically without hardcoded if-else statements.
-Think step-by-step about how to execute the user's request using pandas operations or formula functions.
-
-KNOWLEDGE BASE CONTEXT:
-{kb_summary}
-
-TASK DECISION HINT (use as guidance, not strict rule):
-Based on the user prompt, the suggested task is: {task_suggestions.get('suggested_task', 'auto-detect')}
-Reasoning: {', '.join(task_suggestions.get('reasoning', []))}
-Confidence: {task_suggestions.get('confidence', 0)}
-{similar_examples_text}
-{sample_explanation_text}
-
-{prompt}
-
-Return your response as a valid JSON object with no additional formatting.
-Include "operations" array with "execution_instructions" for each operation."""
+            # Only request-specific content goes here; the static instructions and
+            # knowledge base live in the cached system prefix
+            full_prompt = "".join((
+                _TASK_HINT_HEADER,
+                f"Based on the user prompt, the suggested task is: {task_suggestions.get('suggested_task', 'auto-detect')}\n",
+                f"Reasoning: {', '.join(task_suggestions.get('reasoning', []))}\n",
+                f"Confidence: {task_suggestions.get('confidence', 0)}\n",
+                sample_explanation_text,
+                "\n\n",
+                prompt,
+            ))
+            
+            # Retrieved examples get their own message rather than being spliced
+            # into the request, keeping the instructions and the task clearly apart
+            messages = [{"role": "system", "content": self._legacy_system_prompt}]
+            if similar_examples_text:
+                messages.append({"role": "user", "content": similar_examples_text})
+            messages.append({"role": "user", "content": full_prompt})
 
-            response = self.client.chat.completions.create(
-                model=self.default_model,
-                messages=[
-                    {"role": "system", "content": SYSTEM_MESSAGE},
-                    {"role": "user", "content": full_prompt},
-                ],
+            content, prompt_tokens, completion_tokens, cached_tokens = stream_json_completion(
+                self.client, model=self.default_model, messages=messages
             )
+            content = content.strip()
             
-            content = (response.choices[0].message.content or "").strip()
-            
-            prompt_tokens = getattr(response.usage, "prompt_tokens", 0) or 0
-            completion_tokens = getattr(response.usage, "completion_tokens", 0) or 0
             tokens_used = prompt_tokens + completion_tokens
             logger.info(
-                "OpenAI token usage: prompt=%s, completion=%s, total=%s",
+                "OpenAI token usage: prompt=%s (cached=%s), completion=%s, total=%s",
                 prompt_tokens,
+                cached_tokens,
                 completion_tokens,
                 tokens_used,
             )
             
-            if "```json" in content:
-                content = content.split("```json")[1].split("```")[0].strip()
-            elif "```" in content:
-                content = content.split("```")[1].split("```")[0].strip()
-            
-            try:
-                action_plan = json.loads(content)
-            except json.JSONDecodeError:
-                import re
-                json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', content)
-                if json_match:
-                    action_plan = json.loads(json_match.group())
-                else:
-                    raise ValueError(f"Could not parse JSON from response: {content[:200]}")
+            action_plan = parse_json_object(content)
+            if action_plan is None:
+                raise ValueError(f"Could not parse JSON from response: {content[:200]}")
             
             normalized_plan = self._normalize_action_plan(action_plan)
             
             return {
                 "action_plan": normalized_plan,
-                "tokens_used": tokens_used
+                "tokens_used": tokens_used,
+                "cached_tokens": cached_tokens
             }
             
         except json.JSONDecodeError as e:
@@ -503,78 +1134,31 @@ Include "operations" array with "execution_instructions" for each operation."""
         Returns:
             Normalized action plan
         """
-        # Ensure required fields exist
+        task = action_plan.get("task")
+        chart_type = action_plan.get("chart_type")
+        
+        # Ensure required fields exist; task and chart_type are validated
+        # inline (isinstance guards the set lookup against unhashable values)
+        # and interned, since they repeat across every cached plan
         normalized = {
-            "task": action_plan.get("task", "summarize"),
+            "task": sys.intern(task) if isinstance(task, str) and task in _VALID_TASKS else "summarize",
             "columns_needed": action_plan.get("columns_needed", []),
-            "chart_type": action_plan.get("chart_type", "none"),
+            "chart_type": (
+                sys.intern(chart_type)
+                if isinstance(chart_type, str) and chart_type in _VALID_CHART_TYPES
+                else "none"
+            ),
             "steps": action_plan.get("steps", []),
             "operations": action_plan.get("operations", []),  # Include operations list
         }
         
-        # Add optional fields if present
-        if "filters" in action_plan:
-            normalized["filters"] = action_plan["filters"]
-        
-        if "group_by_column" in action_plan:
-            normalized["group_by_column"] = action_plan["group_by_column"]
-        
-        if "aggregate_function" in action_plan:
-            normalized["aggregate_function"] = action_plan["aggregate_function"]
-        
-        if "aggregate_column" in action_plan:
-            normalized["aggregate_column"] = action_plan["aggregate_column"]
-        
-        # Add editing operation fields if present
-        if "delete_rows" in action_plan:
-            normalized["delete_rows"] = action_plan["delete_rows"]
-        
-        if "add_row" in action_plan:
-            normalized["add_row"] = action_plan["add_row"]
-        
-        if "add_column" in action_plan:
-            normalized["add_column"] = action_plan["add_column"]
-        
-        if "delete_column" in action_plan:
-            normalized["delete_column"] = action_plan["delete_column"]
-        
-        if "edit_cell" in action_plan:
-            normalized["edit_cell"] = action_plan["edit_cell"]
-        
-        if "clear_cell" in action_plan:
-            normalized["clear_cell"] = action_plan["clear_cell"]
-        
-        if "auto_fill" in action_plan:
-            normalized["auto_fill"] = action_plan["auto_fill"]
-        
-        if "sort" in action_plan:
-            normalized["sort"] = action_plan["sort"]
-        
-        if "format" in action_plan:
-            normalized["format"] = action_plan["format"]
-        
-        if "conditional_format" in action_plan:
-            normalized["conditional_format"] = action_plan["conditional_format"]
+        # Pass through optional operation fields that are present
+        normalized.update(
+            {key: value for key, value in action_plan.items() if key in _OPTIONAL_PLAN_KEYS}
+        )
         
-        # Add formula operation field if present
-        if "formula" in action_plan:
-            normalized["formula"] = action_plan["formula"]
-        
-        # Validate task
-        valid_tasks = [
-            "summarize", "clean", "group_by", "find_missing",
-            "filter", "combine_sheets", "generate_chart", "transform",
-            "delete_rows", "add_row", "add_column", "delete_column",
-            "edit_cell", "clear_cell", "auto_fill", "sort",
-            "format", "conditional_format", "formula"
-        ]
-        if normalized["task"] not in valid_tasks:
-            normalized["task"] = "summarize"
-        
-        # Validate chart_type
-        valid_chart_types = ["bar", "line", "pie", "histogram", "scatter", "none"]
-        if normalized["chart_type"] not in valid_chart_types:
-            normalized["chart_type"] = "none"
+        if isinstance(normalized.get("aggregate_function"), str):
+            normalized["aggregate_function"] = sys.intern(normalized["aggregate_function"])
         
         return normalized
     
@@ -588,53 +1172,29 @@ Include "operations" array with "execution_instructions" for each operation."""
         Returns:
             Example action plan dictionary
         """
-        examples = {
-            "group_by": {
-                "task": "group_by",
-                "columns_needed": ["Region", "Revenue"],
-                "chart_type": "bar",
-                "steps": [
-                    "group_by Region sum Revenue",
-                    "create_chart bar"
-                ],
-                "group_by_column": "Region",
-                "aggregate_function": "sum",
-                "aggregate_column": "Revenue"
-            },
-            "clean": {
-                "task": "clean",
-                "columns_needed": [],
-                "chart_type": "none",
-                "steps": [
-                    "remove_duplicates",
-                    "fix_formatting",
-                    "handle_missing_values"
-                ]
-            },
-            "summarize": {
-                "task": "summarize",
-                "columns_needed": ["Sales", "Profit"],
-                "chart_type": "bar",
-                "steps": [
-                    "calculate_statistics",
-                    "create_summary_chart"
-                ]
-            },
-            "filter": {
-                "task": "filter",
-                "columns_needed": ["Date", "Amount"],
-                "chart_type": "line",
-                "steps": [
-                    "filter Date >= 2024-01-01",
-                    "create_chart line"
-                ],
-                "filters": {
-                    "column": "Date",
-                    "condition": ">=",
-                    "value": "2024-01-01"
-                }
-            }
-        }
-        
-        return examples.get(task_type, examples["summarize"])
+        # Deep copy so callers can edit the plan without touching the shared sample
+        return copy.deepcopy(
+            _EXAMPLE_ACTION_PLANS.get(task_type, _EXAMPLE_ACTION_PLANS["summarize"])
+        )
+
 
+_agent: Optional[LLMAgent] = None
+_agent_lock = threading.Lock()
+
+
+def get_agent() -> LLMAgent:
+    """
+    Return the process-wide LLMAgent, creating it on first use.
+    
+    The agent owns the bots, caches and loaded training/feedback data, and is
+    safe to share across request threads, so it is built once per process.
+    Creation is serialized by a lock: concurrent first requests must not each
+    build an agent (and each start a cache writer on the same SQLite file).
+    Construction errors (e.g. missing API key) propagate and are not cached.
+    """
+    global _agent
+    if _agent is None:
+        with _agent_lock:
+            if _agent is None:
+                _agent = LLMAgent()
+    return _agent
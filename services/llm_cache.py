@@ -0,0 +1,581 @@
+"""
+LLM Response Cache
+
+Caches interpreted action plans so that repeated or paraphrased prompts against
+the same sheet layout skip the OpenAI round-trip entirely.
+Uses the local sentence-transformers model from EmbeddingService for similarity.
+Both caches can be backed by a SQLite file (LLM_CACHE_DB) so they survive restarts.
+"""
+
+import copy
+import hashlib
+import logging
+import os
+import queue
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, FrozenSet, List, Optional, Tuple
+
+import numpy as np
+
+from services.embedding_service import EmbeddingService
+from utils.json_extract import json_dumps, json_loads
+
+logger = logging.getLogger(__name__)
+
+# Numbers and quoted values in a prompt ("top 5", "> 100", 'Car detailing')
+_LITERAL_PATTERN = re.compile(r'"[^"]*"|\'[^\']*\'|\d+(?:\.\d+)?')
+
+# Direction, polarity, aggregate and style words (plus comparison operators).
+# Pairs like "sort ascending"/"sort descending" or "keep"/"remove rows where ..."
+# embed almost identically, so these must match exactly too
+_POLARITY_PATTERN = re.compile(
+    r"[<>]=?|!=|=="
+    r"|\b(?:asc|ascending|desc|descending|increasing|decreasing|reverse"
+    r"|highest|lowest|largest|smallest|top|bottom|first|last"
+    r"|above|below|before|after|greater|less|more|fewer|min|minimum|max|maximum"
+    r"|keep|remove|delete|drop|exclude|include|only|not|empty|blank|missing"
+    r"|sum|total|average|mean|median|count"
+    r"|red|green|blue|yellow|orange|purple|pink|black|white|gray|grey"
+    r"|bold|italic|underline|underlined|strikethrough|uppercase|lowercase)\b"
+)
+
+
+def _default_ttl() -> Optional[float]:
+    """Entry lifetime in seconds from LLM_CACHE_TTL (default 7 days; 0 disables expiry)"""
+    ttl = float(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+    return ttl if ttl > 0 else None
+
+
+def columns_signature(available_columns: List[str]) -> Tuple[str, ...]:
+    """
+    Build a hashable signature for a column layout.
+
+    Order is preserved on purpose: plans resolve positional references
+    ("3rd column", "column C") against it.
+
+    Args:
+        available_columns: Column names of the sheet
+
+    Returns:
+        Tuple of column names
+    """
+    return tuple(str(col) for col in available_columns)
+
+
+def sample_signature(sample_data: Optional[List[Dict]], rows: int = 5) -> str:
+    """
+    Fingerprint the leading sample rows shown to the LLM.
+
+    Two sheets with the same layout but different contents can warrant
+    different plans, so both exact and semantic hits require the same sample.
+
+    Args:
+        sample_data: Sample rows passed to interpret_prompt
+        rows: Number of leading rows to fingerprint
+
+    Returns:
+        Hex digest, or "" when there is no sample
+    """
+    if not sample_data:
+        return ""
+    # repr is deterministic for the plain dict rows used here and, unlike
+    # JSON, accepts any cell type (timestamps, numpy scalars, ...)
+    return hashlib.blake2b(repr(sample_data[:rows]).encode("utf-8", "surrogatepass"), digest_size=16).hexdigest()
+
+
+def prompt_literals(user_prompt: str, available_columns: List[str]) -> FrozenSet[str]:
+    """
+    Collect the parts of a prompt that embeddings barely distinguish.
+
+    "delete rows where Age > 30" and "... Age > 40", "sum Revenue" and
+    "sum Profit", or "sort by Age ascending" and "... descending" on the same
+    sheet embed almost identically but need different plans. Semantic hits
+    require these literals to match exactly.
+
+    Args:
+        user_prompt: User's prompt
+        available_columns: Column names of the sheet
+
+    Returns:
+        Numbers, quoted values, polarity/style words and mentioned column
+        names (lowercased)
+    """
+    # Quoted values keep their case (filters may be case-sensitive)
+    literals = set(_LITERAL_PATTERN.findall(user_prompt))
+    text = user_prompt.lower()
+    literals.update(_POLARITY_PATTERN.findall(text))
+    literals.update(
+        name for name in (str(col).lower() for col in available_columns)
+        if name and name in text
+    )
+    return frozenset(literals)
+
+
+class CacheStore:
+    """
+    SQLite persistence for ExactCache and SemanticCache.
+
+    Rows are loaded once at startup; writes go through a queue to a single
+    background thread, so request threads never wait on disk I/O.
+    """
+
+    _SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS exact_cache ("
+        "key BLOB PRIMARY KEY, result TEXT NOT NULL, ts REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS semantic_cache ("
+        "key BLOB PRIMARY KEY, cols TEXT NOT NULL, literals TEXT NOT NULL, "
+        "sample TEXT NOT NULL DEFAULT '', "
+        "embedding BLOB NOT NULL, result TEXT NOT NULL, hits INTEGER NOT NULL, ts REAL NOT NULL)",
+    )
+
+    def __init__(self, path: str):
+        """
+        Open (or create) the cache database
+
+        Args:
+            path: SQLite database file
+        """
+        self.path = path
+        conn = self._connect()
+        try:
+            for statement in self._SCHEMA:
+                conn.execute(statement)
+            # Databases created before semantic rows carried a sample signature;
+            # their rows get "" and only match requests without sample data
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(semantic_cache)")}
+            if "sample" not in columns:
+                conn.execute("ALTER TABLE semantic_cache ADD COLUMN sample TEXT NOT NULL DEFAULT ''")
+            conn.commit()
+        finally:
+            conn.close()
+        self._queue: "queue.Queue[Tuple[str, tuple]]" = queue.Queue()
+        self._writer = threading.Thread(target=self._write_loop, name="llm-cache-writer", daemon=True)
+        self._writer.start()
+
+    @classmethod
+    def from_env(cls) -> Optional["CacheStore"]:
+        """Create a store at LLM_CACHE_DB, or None if persistence is not configured"""
+        path = os.getenv("LLM_CACHE_DB")
+        if not path:
+            return None
+        try:
+            return cls(path)
+        except sqlite3.Error as e:
+            logger.warning(f"LLM cache persistence disabled ({path}): {e}")
+            return None
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        # WAL + NORMAL: readers don't block the writer and commits skip most fsyncs;
+        # losing the last few cache writes on power failure is harmless
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        return conn
+
+    def _write_loop(self):
+        """Apply queued writes, committing once per burst"""
+        conn = self._connect()
+        while True:
+            statement, params = self._queue.get()
+            taken = 1
+            try:
+                conn.execute(statement, params)
+                # Drain whatever else is queued into the same transaction
+                while True:
+                    try:
+                        statement, params = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    taken += 1
+                    conn.execute(statement, params)
+                conn.commit()
+            except Exception as e:
+                logger.warning(f"LLM cache write failed: {e}")
+                conn.rollback()
+            finally:
+                for _ in range(taken):
+                    self._queue.task_done()
+
+    def _enqueue(self, statement: str, params: tuple):
+        self._queue.put((statement, params))
+
+    def flush(self):
+        """Block until every write queued so far has been committed (or failed)"""
+        self._queue.join()
+
+    def load_exact(self, limit: int, since: float = 0.0) -> List[Tuple[bytes, float, Dict]]:
+        """Most recent exact-cache rows stored at or after `since`, oldest first"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT key, ts, result FROM exact_cache WHERE ts >= ? ORDER BY ts DESC LIMIT ?",
+                (since, limit),
+            ).fetchall()
+        finally:
+            conn.close()
+        return [(bytes(key), ts, json_loads(result)) for key, ts, result in reversed(rows)]
+
+    def save_exact(self, key: bytes, result: Dict, stored_at: float):
+        self._enqueue(
+            "INSERT OR REPLACE INTO exact_cache (key, result, ts) VALUES (?, ?, ?)",
+            (key, json_dumps(result), stored_at),
+        )
+
+    def delete_exact(self, key: bytes):
+        self._enqueue("DELETE FROM exact_cache WHERE key = ?", (key,))
+
+    def load_semantic(
+        self, limit: int, since: float = 0.0
+    ) -> List[Tuple[bytes, np.ndarray, Tuple[str, ...], FrozenSet[str], str, Dict, int, float]]:
+        """Most recent semantic-cache rows stored at or after `since`, oldest first"""
+        conn = self._connect()
+        try:
+            rows = conn.execute(
+                "SELECT key, embedding, cols, literals, sample, result, hits, ts FROM semantic_cache "
+                "WHERE ts >= ? ORDER BY ts DESC LIMIT ?", (since, limit)
+            ).fetchall()
+        finally:
+            conn.close()
+        return [
+            (
+                bytes(key),
+                np.frombuffer(embedding, dtype=np.float32),
+                tuple(json_loads(cols)),
+                frozenset(json_loads(literals)),
+                sample,
+                json_loads(result),
+                hits,
+                ts,
+            )
+            for key, embedding, cols, literals, sample, result, hits, ts in reversed(rows)
+        ]
+
+    def save_semantic(
+        self,
+        key: bytes,
+        embedding: np.ndarray,
+        columns_key: Tuple[str, ...],
+        literals: FrozenSet[str],
+        sample_key: str,
+        result: Dict,
+        stored_at: float,
+    ):
+        self._enqueue(
+            "INSERT OR REPLACE INTO semantic_cache (key, cols, literals, sample, embedding, result, hits, ts) "
+            "VALUES (?, ?, ?, ?, ?, ?, 0, ?)",
+            (
+                key,
+                json_dumps(list(columns_key)),
+                json_dumps(sorted(literals)),
+                sample_key,
+                np.asarray(embedding, dtype=np.float32).tobytes(),
+                json_dumps(result),
+                stored_at,
+            ),
+        )
+
+    def update_semantic_hits(self, key: bytes, hits: int):
+        self._enqueue("UPDATE semantic_cache SET hits = ? WHERE key = ?", (hits, key))
+
+    def delete_semantic(self, key: bytes):
+        self._enqueue("DELETE FROM semantic_cache WHERE key = ?", (key,))
+
+
+class ExactCache:
+    """LRU cache keyed by the exact prompt text and column layout"""
+
+    def __init__(
+        self,
+        max_entries: int = 4096,
+        namespace: str = "",
+        store: Optional[CacheStore] = None,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Initialize exact-match cache
+
+        Args:
+            max_entries: Maximum number of cached results (least recently used evicted first)
+            namespace: Mixed into every key, e.g. the model names, so results
+                cached under one configuration are never served under another
+            store: Optional persistent store; previously cached results are loaded from it
+            ttl: Seconds a result stays valid, so plans pick up prompt and
+                knowledge-base changes eventually (default: LLM_CACHE_TTL env var)
+        """
+        self.max_entries = max_entries
+        self.namespace = namespace
+        self.store = store
+        self.ttl = ttl if ttl is not None else _default_ttl()
+        self._lock = threading.Lock()
+        # key -> (stored_at, result)
+        self._entries: "OrderedDict[bytes, Tuple[float, Dict]]" = OrderedDict()
+        if store is not None:
+            # Keys already include the namespace, so rows from other models never match
+            since = time.time() - self.ttl if self.ttl else 0.0
+            for key, stored_at, result in store.load_exact(max_entries, since):
+                self._entries[key] = (stored_at, result)
+
+    def _key(self, user_prompt: str, columns_key: Tuple[str, ...], sample_key: str) -> bytes:
+        """Fixed-size digest of the lookup inputs (long prompts aren't kept as keys)"""
+        digest = hashlib.blake2b(digest_size=16)
+        # NUL separators: column names and prompts can't be shifted across fields
+        for part in (self.namespace, sample_key, user_prompt, *columns_key):
+            digest.update(part.encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+        return digest.digest()
+
+    def get(self, user_prompt: str, columns_key: Tuple[str, ...], sample_key: str = "") -> Optional[Dict]:
+        """
+        Look up a cached result
+
+        Args:
+            user_prompt: User's prompt
+            columns_key: Signature from columns_signature()
+            sample_key: Signature from sample_signature()
+
+        Returns:
+            Copy of the cached result or None on a miss
+        """
+        key = self._key(user_prompt, columns_key, sample_key)
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is None:
+                return None
+            stored_at, result = cached
+            if self.ttl and time.time() - stored_at > self.ttl:
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+        logger.info("Exact cache hit")
+        return copy.deepcopy(result)
+
+    def put(self, user_prompt: str, columns_key: Tuple[str, ...], result: Dict, sample_key: str = ""):
+        """
+        Store a result
+
+        Args:
+            user_prompt: User's prompt
+            columns_key: Signature from columns_signature()
+            result: Result dict returned by LLMAgent.interpret_prompt
+            sample_key: Signature from sample_signature()
+        """
+        key = self._key(user_prompt, columns_key, sample_key)
+        result = copy.deepcopy(result)
+        stored_at = time.time()
+        evicted = None
+        with self._lock:
+            self._entries[key] = (stored_at, result)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_entries:
+                evicted, _ = self._entries.popitem(last=False)
+        if self.store is not None:
+            self.store.save_exact(key, result, stored_at)
+            if evicted is not None:
+                self.store.delete_exact(evicted)
+
+
+class _SemanticEntry:
+    """A cached plan plus the gates it was stored under and its hit count"""
+
+    __slots__ = ("key", "columns_key", "literals", "sample_key", "result", "hits", "stored_at")
+
+    def __init__(
+        self,
+        key: bytes,
+        columns_key: Tuple[str, ...],
+        literals: FrozenSet[str],
+        sample_key: str,
+        result: Dict,
+        stored_at: float,
+        hits: int = 0,
+    ):
+        self.key = key
+        self.stored_at = stored_at
+        self.columns_key = columns_key
+        self.literals = literals
+        self.sample_key = sample_key
+        self.result = result
+        self.hits = hits
+
+
+class SemanticCache:
+    """Embedding-similarity cache for interpreted prompts"""
+
+    def __init__(
+        self,
+        threshold: Optional[float] = None,
+        max_entries: int = 1024,
+        store: Optional[CacheStore] = None,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Initialize semantic cache
+
+        Args:
+            threshold: Minimum cosine similarity for a cache hit
+                (default: SEMANTIC_CACHE_THRESHOLD env var, else 0.93)
+            max_entries: Maximum number of cached plans. When full, the entry
+                with the fewest (periodically halved) hits is evicted, oldest
+                first among ties, so frequently reused plans survive bursts of
+                one-off prompts
+            store: Optional persistent store; previously cached plans are
+                loaded from it, so prompts are not re-embedded after a restart
+            ttl: Seconds a plan stays valid (default: LLM_CACHE_TTL env var).
+                Expired plans are never served and are evicted first
+        """
+        if threshold is None:
+            threshold = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.93"))
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl if ttl is not None else _default_ttl()
+        self.embedding_service = None  # Lazy load
+        self._lock = threading.Lock()
+        # L2-normalized prompt embeddings, one row per entry in self._entries
+        self._matrix: Optional[np.ndarray] = None
+        self._entries: List[_SemanticEntry] = []
+        self._puts_since_decay = 0
+        self.store = store
+        if store is not None:
+            rows = store.load_semantic(max_entries, time.time() - self.ttl if self.ttl else 0.0)
+            # Skip rows from a different embedding model (dimension mismatch)
+            dims = {row[1].shape[0] for row in rows}
+            if len(dims) == 1:
+                self._matrix = np.vstack([row[1] for row in rows])
+                self._entries = [
+                    _SemanticEntry(key, columns_key, literals, sample_key, result, stored_at, hits)
+                    for key, _, columns_key, literals, sample_key, result, hits, stored_at in rows
+                ]
+            elif rows:
+                logger.warning("Ignoring persisted semantic cache: inconsistent embedding sizes")
+
+    def embed(self, text: str) -> Optional[np.ndarray]:
+        """
+        Generate a normalized embedding for a prompt
+
+        Args:
+            text: Prompt to encode
+
+        Returns:
+            Unit-length embedding or None if embeddings are unavailable
+        """
+        if self.embedding_service is None:
+            self.embedding_service = EmbeddingService()
+        if not self.embedding_service.is_available():
+            return None
+
+        embedding = self.embedding_service.encode(text)
+        if embedding is None:
+            return None
+        embedding = np.asarray(embedding, dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) + 1e-8)
+
+    def get(
+        self,
+        embedding: Optional[np.ndarray],
+        columns_key: Tuple[str, ...],
+        literals: FrozenSet[str] = frozenset(),
+        sample_key: str = "",
+    ) -> Optional[Dict]:
+        """
+        Look up the closest cached result for the same column layout and sample
+
+        Args:
+            embedding: Normalized prompt embedding from embed()
+            columns_key: Signature from columns_signature()
+            literals: Signature from prompt_literals(); must match exactly
+            sample_key: Signature from sample_signature(); must match exactly
+
+        Returns:
+            Copy of the cached result or None on a miss
+        """
+        if embedding is None:
+            return None
+        with self._lock:
+            matrix, entries = self._matrix, self._entries
+        if matrix is None:
+            return None
+
+        similarities = matrix @ embedding
+        expired_before = time.time() - self.ttl if self.ttl else None
+        # Best match first; stop at the first one below threshold
+        for idx in np.argsort(similarities)[::-1]:
+            if similarities[idx] < self.threshold:
+                break
+            entry = entries[idx]
+            if expired_before is not None and entry.stored_at < expired_before:
+                continue
+            if (
+                entry.columns_key == columns_key
+                and entry.literals == literals
+                and entry.sample_key == sample_key
+            ):
+                with self._lock:
+                    entry.hits += 1
+                    hits = entry.hits
+                if self.store is not None:
+                    self.store.update_semantic_hits(entry.key, hits)
+                logger.info(f"Semantic cache hit (similarity={similarities[idx]:.3f}, hits={entry.hits})")
+                return copy.deepcopy(entry.result)
+        return None
+
+    def put(
+        self,
+        embedding: Optional[np.ndarray],
+        columns_key: Tuple[str, ...],
+        result: Dict,
+        literals: FrozenSet[str] = frozenset(),
+        sample_key: str = "",
+    ):
+        """
+        Store a result
+
+        Args:
+            embedding: Normalized prompt embedding from embed()
+            columns_key: Signature from columns_signature()
+            result: Result dict returned by LLMAgent.interpret_prompt
+            literals: Signature from prompt_literals()
+            sample_key: Signature from sample_signature()
+        """
+        if embedding is None:
+            return
+
+        row = embedding.reshape(1, -1)
+        # Row identity for the persistent store
+        digest = hashlib.blake2b(row.astype(np.float32).tobytes(), digest_size=16)
+        for part in (sample_key, *columns_key, "\0", *sorted(literals)):
+            digest.update(part.encode("utf-8", "surrogatepass"))
+            digest.update(b"\0")
+        stored_at = time.time()
+        entry = _SemanticEntry(digest.digest(), columns_key, literals, sample_key, copy.deepcopy(result), stored_at)
+        evicted = None
+        # Matrix and entries are swapped in together (never mutated in place)
+        # so concurrent readers always see rows and entries that line up
+        with self._lock:
+            matrix = row if self._matrix is None else np.vstack([self._matrix, row])
+            entries = self._entries + [entry]
+            # Halve hit counts once per max_entries insertions so plans that
+            # were popular long ago eventually become evictable again
+            self._puts_since_decay += 1
+            if self._puts_since_decay >= self.max_entries:
+                self._puts_since_decay = 0
+                for cached in entries:
+                    cached.hits //= 2
+            if len(entries) > self.max_entries:
+                # Never evict the entry just added; expired entries go first
+                expired_before = stored_at - self.ttl if self.ttl else float("-inf")
+                victim = min(
+                    range(len(entries) - 1),
+                    key=lambda i: (entries[i].stored_at >= expired_before, entries[i].hits),
+                )
+                evicted = entries[victim]
+                matrix = np.delete(matrix, victim, axis=0)
+                entries = entries[:victim] + entries[victim + 1:]
+            self._matrix, self._entries = matrix, entries
+        if self.store is not None:
+            self.store.save_semantic(entry.key, row, columns_key, literals, sample_key, entry.result, stored_at)
+            if evicted is not None:
+                self.store.delete_semantic(evicted.key)
@@ -0,0 +1,114 @@
+"""
+Streaming JSON Completions
+
+Shared OpenAI call used by LLMAgent and the bots: streams a JSON-mode chat
+completion and stops buffering as soon as the answer's JSON object closes.
+"""
+
+import os
+from typing import Any, Dict, List, Tuple
+
+from openai import DEFAULT_CONNECTION_LIMITS, DEFAULT_TIMEOUT, DefaultHttpxClient, OpenAI
+
+from utils.json_extract import JsonObjectScanner
+
+# Request options identical on every call, built once instead of per request.
+# JSON mode: the reply is always a bare JSON object, never fenced.
+_JSON_STREAM_OPTIONS = {
+    "stream": True,
+    "stream_options": {"include_usage": True},
+    "response_format": {"type": "json_object"},
+}
+
+
+def create_openai_client(api_key: str) -> OpenAI:
+    """
+    Create an OpenAI client with a connection pool tuned for this service
+    
+    Idle keep-alive connections are held for 30s instead of httpx's 5s, so
+    requests arriving a few seconds apart reuse a warm TLS connection rather
+    than handshaking again. Streamed reads time out after OPENAI_TIMEOUT
+    seconds without a chunk (default 60) instead of the SDK's 10 minutes.
+    Rate-limited and transient failures are retried OPENAI_MAX_RETRIES times
+    (default 2) by the SDK, with exponential backoff that honours the
+    server's retry-after header.
+    
+    Args:
+        api_key: OpenAI API key
+        
+    Returns:
+        OpenAI client
+    """
+    read_timeout = float(os.getenv("OPENAI_TIMEOUT", "60"))
+    # Built from the SDK's own defaults' classes so they always match the HTTP
+    # library the installed SDK version uses
+    limits = type(DEFAULT_CONNECTION_LIMITS)(
+        max_connections=100, max_keepalive_connections=100, keepalive_expiry=30.0
+    )
+    timeout = type(DEFAULT_TIMEOUT)(read_timeout, connect=5.0, pool=10.0)
+    return OpenAI(
+        api_key=api_key,
+        timeout=timeout,
+        max_retries=int(os.getenv("OPENAI_MAX_RETRIES", "2")),
+        http_client=DefaultHttpxClient(limits=limits, timeout=timeout),
+    )
+
+
+def usage_tokens(usage: Any) -> Tuple[int, int]:
+    """
+    Read (prompt_tokens, completion_tokens) from a usage object.
+    
+    The SDK's usage objects always carry both counts as ints; only the usage
+    itself can be missing (e.g. a stream cut off before its final chunk),
+    which counts as 0 tokens.
+    """
+    if usage is None:
+        return 0, 0
+    return usage.prompt_tokens, usage.completion_tokens
+
+
+def cached_prompt_tokens(usage: Any) -> int:
+    """
+    Read how many prompt tokens were served from OpenAI's prompt cache.
+    
+    These are already included in prompt_tokens; tracking them separately
+    shows whether the static prompt prefixes are actually being reused.
+    prompt_tokens_details is absent on some models and older SDK versions.
+    """
+    details = getattr(usage, "prompt_tokens_details", None)
+    return getattr(details, "cached_tokens", None) or 0
+
+
+def stream_json_completion(client: OpenAI, model: str, messages: List[Dict]) -> Tuple[str, int, int, int]:
+    """
+    Stream a chat completion in JSON mode
+    
+    Text is accumulated only until the first top-level object closes, so the
+    caller can parse as soon as the last brace arrives and nothing after it is
+    buffered. The remainder of the stream is still drained: token usage
+    (billed to the user) only arrives in the final chunk.
+    
+    Args:
+        client: OpenAI client
+        model: Model to use
+        messages: Chat messages
+        
+    Returns:
+        Tuple of (content, prompt_tokens, completion_tokens, cached_tokens)
+    """
+    stream = client.chat.completions.create(model=model, messages=messages, **_JSON_STREAM_OPTIONS)
+    
+    scanner = JsonObjectScanner()
+    parts = []
+    usage = None
+    for chunk in stream:
+        if chunk.usage is not None:
+            usage = chunk.usage
+        if scanner.done or not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta.content
+        if delta:
+            parts.append(scanner.feed(delta))
+    
+    prompt_tokens, completion_tokens = usage_tokens(usage)
+    return "".join(parts), prompt_tokens, completion_tokens, cached_prompt_tokens(usage)
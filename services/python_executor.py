@@ -17,6 +17,28 @@ from services.cleaning.text import TextCleaner
 
 logger = logging.getLogger(__name__)
 
+# Cleanup/validation patterns, compiled once since every generated snippet
+# passes through _clean_code and _validate_code
+_CODE_FENCE_PATTERN = re.compile(r'```[a-z]*\n?')
+_INLINE_CONTROL_FLOW_PATTERN = re.compile(r';\s*(?:for\s+\w+\s+in\s+|if\s+|elif\s+|else\s*:)')
+_CONTROL_FLOW_START_PATTERN = re.compile(r'(?:for|if|elif|else)\s+|else\s*:')
+_SYNTAX_FIXES = (
+    (re.compile(r'\[None\)\*\('), '[None] * ('),  # [None)*( -> [None] * (
+    (re.compile(r'\bgrouped\.co\b'), 'grouped.columns'),  # grouped.co -> grouped.columns
+    (re.compile(r'\bfor_in\b'), 'for _ in'),  # for_in -> for _ in
+    (re.compile(r'\bfor\s+_in\b'), 'for _ in'),  # for _in -> for _ in
+)
+_IMPORT_PATTERN = re.compile(r'\bimport\s+\w+|from\s+\w+\s+import')
+# (source, compiled) pairs; the source is reported in the validation error
+_DANGEROUS_PATTERNS = tuple(
+    (pattern, re.compile(pattern))
+    for pattern in (
+        r'\bopen\s*\(', r'\bread\s*\(', r'\bwrite\s*\(',
+        r'__file__', r'__import__', r'eval\s*\(', r'exec\s*\(',
+        r'\bos\.|sys\.|subprocess\.|shutil\.',
+    )
+)
+
 
 class PythonExecutor:
     """Robust Python code executor for Excel operations"""
@@ -253,10 +275,10 @@ class PythonExecutor:
             code = '\n'.join(lines)
         
         # Remove any remaining ``` markers
-        code = re.sub(r'```[a-z]*\n?', '', code)
+        code = _CODE_FENCE_PATTERN.sub('', code)
         
         # 3. Fix for/if statements on same line with semicolons (CRITICAL - Python syntax requirement)
-        if ';' in code and (re.search(r';\s*for\s+\w+\s+in\s+', code) or re.search(r';\s*if\s+', code) or re.search(r';\s*elif\s+', code) or re.search(r';\s*else\s*:', code)):
+        if ';' in code and _INLINE_CONTROL_FLOW_PATTERN.search(code):
             parts = []
             current_part = ''
             in_block = False
@@ -267,7 +289,7 @@ class PythonExecutor:
                     continue
                 
                 # Check for control flow statements
-                if re.match(r'(for|if|elif|else)\s+', segment) or re.match(r'else\s*:', segment):
+                if _CONTROL_FLOW_START_PATTERN.match(segment):
                     if current_part:
                         parts.append(current_part)
                         current_part = ''
@@ -302,10 +324,8 @@ class PythonExecutor:
         code = '\n'.join(fixed_lines)
         
         # 5. Fix common syntax errors
-        code = re.sub(r'\[None\)\*\(', '[None] * (', code)  # [None)*( -> [None] * (
-        code = re.sub(r'\bgrouped\.co\b', 'grouped.columns', code)  # grouped.co -> grouped.columns
-        code = re.sub(r'\bfor_in\b', 'for _ in', code)  # for_in -> for _ in
-        code = re.sub(r'\bfor\s+_in\b', 'for _ in', code)  # for _in -> for _ in
+        for pattern, replacement in _SYNTAX_FIXES:
+            code = pattern.sub(replacement, code)
         
         return code.strip()
     
@@ -327,17 +347,12 @@ class PythonExecutor:
             return {"valid": False, "error": "Code is empty after cleaning"}
         
         # Check 1: No import statements
-        if re.search(r'\bimport\s+\w+|from\s+\w+\s+import', cleaned_code):
+        if _IMPORT_PATTERN.search(cleaned_code):
             return {"valid": False, "error": "Import statements are not allowed"}
         
         # Check 2: No dangerous operations
-        dangerous_patterns = [
-            r'\bopen\s*\(', r'\bread\s*\(', r'\bwrite\s*\(',
-            r'__file__', r'__import__', r'eval\s*\(', r'exec\s*\(',
-            r'\bos\.|sys\.|subprocess\.|shutil\.',
-        ]
-        for pattern in dangerous_patterns:
-            if re.search(pattern, cleaned_code):
+        for pattern, compiled in _DANGEROUS_PATTERNS:
+            if compiled.search(cleaned_code):
                 return {"valid": False, "error": f"Dangerous operation detected: {pattern}"}
         
         # Check 3: Basic syntax validation
@@ -8,14 +8,20 @@ Supports both keyword and semantic search.
 import pandas as pd
 import json
 import logging
+import threading
+from collections import OrderedDict
 from pathlib import Path
 from typing import List, Dict, Optional
 import numpy as np
 
 from services.embedding_service import EmbeddingService
+from utils.json_extract import parse_json_object
 
 logger = logging.getLogger(__name__)
 
+# Distinct prompts whose retrieved examples are kept (least recently used evicted)
+_RESULTS_CACHE_SIZE = 512
+
 
 class TrainingDataLoader:
     """Load and manage training datasets for few-shot learning"""
@@ -33,6 +39,10 @@ class TrainingDataLoader:
         self.embeddings_cache: Dict[str, np.ndarray] = {}  # Cache embeddings
         self._embeddings_generated = False  # Lazy loading flag
         self._datasets_loaded = False  # Track if datasets have been loaded
+        # Retrieval results per (normalized prompt, limit, categories, mode);
+        # the datasets only change on reload(), which clears it
+        self._results_cache: "OrderedDict[tuple, List[Dict]]" = OrderedDict()
+        self._results_lock = threading.Lock()
         # Don't load datasets on init - do it lazily on first use to save memory
         # self._load_datasets()
         # Don't generate embeddings on init - do it lazily on first use
@@ -156,32 +166,12 @@ class TrainingDataLoader:
                         if action_plan_col and pd.notna(row[action_plan_col]):
                             action_plan_str = str(row[action_plan_col]).strip()
                             
-                            # Handle format: JSON + explanation (extract JSON part)
-                            # Try to find JSON object in the response
-                            import re
-                            
-                            # First, try direct JSON parse
-                            try:
-                                action_plan = json.loads(action_plan_str)
-                            except json.JSONDecodeError:
-                                # Try to extract JSON from text (handles "JSON + explanation" format)
-                                # Look for JSON object (handles multi-line JSON)
-                                json_match = re.search(r'\{[^{}]*(?:\{[^{}]*\}[^{}]*)*\}', action_plan_str, re.DOTALL)
-                                if json_match:
-                                    try:
-                                        action_plan = json.loads(json_match.group())
-                                    except json.JSONDecodeError:
-                                        # Try to find JSON in code blocks
-                                        code_block_match = re.search(r'```(?:json)?\s*(\{.*?\})\s*```', action_plan_str, re.DOTALL)
-                                        if code_block_match:
-                                            try:
-                                                action_plan = json.loads(code_block_match.group(1))
-                                            except json.JSONDecodeError:
-                                                pass
-                                
-                                if not action_plan:
-                                    logger.warning(f"Could not parse action plan for prompt: {prompt[:50]}")
-                                    continue
+                            # Handle format: JSON + explanation (extract JSON part),
+                            # including ```json fenced blocks
+                            action_plan = parse_json_object(action_plan_str)
+                            if not action_plan:
+                                logger.warning(f"Could not parse action plan for prompt: {prompt[:50]}")
+                                continue
                         
                         if not action_plan:
                             continue
@@ -248,7 +238,8 @@ class TrainingDataLoader:
         user_prompt: str, 
         limit: int = 5,
         categories: Optional[List[str]] = None,
-        use_semantic: bool = True
+        use_semantic: bool = True,
+        query_embedding: Optional[np.ndarray] = None
     ) -> List[Dict]:
         """
         Get relevant examples for a user prompt using semantic search
@@ -259,6 +250,8 @@ class TrainingDataLoader:
             limit: Maximum number of examples to return
             categories: Optional list of categories to filter by (e.g., ["cleaning", "formulas"])
             use_semantic: Whether to use semantic search (True) or keyword search (False)
+            query_embedding: Precomputed embedding of user_prompt, so callers that
+                already embedded it (e.g. for caching) don't encode it again
             
         Returns:
             List of similar examples
@@ -269,35 +262,47 @@ class TrainingDataLoader:
         if not self.datasets:
             return []
         
+        cache_key = (user_prompt.strip().lower(), limit, tuple(categories) if categories else None, use_semantic)
+        with self._results_lock:
+            cached = self._results_cache.get(cache_key)
+            if cached is not None:
+                self._results_cache.move_to_end(cache_key)
+                return list(cached)
+        
+        # Lazy load embedding service on first use
+        if self.embedding_service is None:
+            self.embedding_service = EmbeddingService()
+        
         # Use semantic search if available, otherwise fall back to keyword
         if use_semantic and self.embedding_service.is_available():
-            return self._semantic_search(user_prompt, limit, categories)
+            results = self._semantic_search(user_prompt, limit, categories, query_embedding)
         else:
-            return self._keyword_search(user_prompt, limit, categories)
+            results = self._keyword_search(user_prompt, limit, categories)
+        
+        with self._results_lock:
+            self._results_cache[cache_key] = results
+            if len(self._results_cache) > _RESULTS_CACHE_SIZE:
+                self._results_cache.popitem(last=False)
+        return list(results)
     
     def _semantic_search(
         self,
         user_prompt: str,
         limit: int = 5,
-        categories: Optional[List[str]] = None
+        categories: Optional[List[str]] = None,
+        query_embedding: Optional[np.ndarray] = None
     ) -> List[Dict]:
         """Find examples using semantic similarity"""
         try:
-            # Lazy load embedding service on first use
-            if self.embedding_service is None:
-                self.embedding_service = _get_embedding_service()
-                if self.embedding_service is None:
-                    # Fall back to keyword search if embeddings unavailable
-                    return self._keyword_search(user_prompt, limit, categories)
-            
             # Lazy load embeddings on first use (not on init to save memory)
             if not self._embeddings_generated and self.embedding_service.is_available():
                 logger.info("Generating embeddings for training examples (lazy load)...")
                 self._generate_embeddings()
                 self._embeddings_generated = True
             
-            # Generate embedding for user prompt
-            query_embedding = self.embedding_service.encode(user_prompt)
+            # Generate embedding for user prompt (unless the caller already did)
+            if query_embedding is None:
+                query_embedding = self.embedding_service.encode(user_prompt)
             if query_embedding is None:
                 # Fall back to keyword search if embedding fails
                 return self._keyword_search(user_prompt, limit, categories)
@@ -419,6 +424,8 @@ class TrainingDataLoader:
     def reload(self):
         """Reload datasets from disk"""
         self.datasets = []
+        with self._results_lock:
+            self._results_cache.clear()
         self._load_datasets()
     
     def get_statistics(self) -> Dict:
@@ -0,0 +1,82 @@
+"""
+Test script to verify local complexity classification (simple vs complex prompts)
+
+The margin/floor rules run offline. The labelled check against known prompts
+needs the local embedding model and is skipped when it isn't available.
+Run with `python test_complexity_classifier.py` or `python -m pytest test_complexity_classifier.py`.
+"""
+import numpy as np
+
+from services.llm_agent import (
+    _COMPLEXITY_EXEMPLARS, _COMPLEXITY_MIN_MARGIN, _COMPLEXITY_MIN_SIMILARITY, _label_from_exemplars,
+)
+from services.llm_cache import SemanticCache
+
+LABELS = np.array([False, False, True, True])
+
+# Prompts that are not exemplars, with the model they should be routed to
+KNOWN_PROMPTS = (
+    ("sort the table by name", False),
+    ("delete the empty rows", False),
+    ("change the header of column C to Total", False),
+    ("make column A bold", False),
+    ("sum the amount column", False),
+    ("filter to rows where country is India", False),
+    ("draw a pie chart of expenses by category", False),
+    ("for each salesperson, total their sales per quarter and rank them", True),
+    ("match emails from sheet 2 to names in sheet 1 and fill in the missing phone numbers", True),
+    ("flag invoices overdue by more than 30 days that are unpaid, then total them by client", True),
+    ("calculate year over year change by region and highlight drops over 10%", True),
+    ("extract the domain from each email, group by domain and count the users", True),
+)
+
+
+def test_clear_winner_is_used():
+    assert _label_from_exemplars(np.array([0.9, 0.3, 0.4, 0.2]), LABELS) is False
+    assert _label_from_exemplars(np.array([0.3, 0.2, 0.5, 0.8]), LABELS) is True
+
+
+def test_low_similarity_defers_to_llm():
+    just_below = _COMPLEXITY_MIN_SIMILARITY - 0.01
+    assert _label_from_exemplars(np.array([just_below, 0.1, 0.1, 0.1]), LABELS) is None
+
+
+def test_close_call_defers_to_llm():
+    best = 0.8
+    runner_up = best - _COMPLEXITY_MIN_MARGIN / 2
+    assert _label_from_exemplars(np.array([best, 0.2, runner_up, 0.2]), LABELS) is None
+    assert _label_from_exemplars(np.array([runner_up, 0.2, best, 0.2]), LABELS) is None
+
+
+def test_known_prompts_are_never_misrouted():
+    """Each known prompt gets its correct label or is left to the LLM - never the wrong one"""
+    cache = SemanticCache()
+    exemplar_embeddings = [cache.embed(prompt) for prompt, _ in _COMPLEXITY_EXEMPLARS]
+    if any(embedding is None for embedding in exemplar_embeddings):
+        print("   (skipped: embedding model not available)")
+        return
+    matrix = np.vstack(exemplar_embeddings)
+    labels = np.array([is_complex for _, is_complex in _COMPLEXITY_EXEMPLARS])
+
+    decided = 0
+    for prompt, expected in KNOWN_PROMPTS:
+        verdict = _label_from_exemplars(matrix @ cache.embed(prompt), labels)
+        assert verdict in (None, expected), f"{prompt!r} labelled {verdict}, expected {expected}"
+        decided += verdict is not None
+    print(f"   {decided}/{len(KNOWN_PROMPTS)} known prompts decided locally")
+
+
+if __name__ == "__main__":
+    tests = [(name, func) for name, func in sorted(globals().items()) if name.startswith("test_")]
+    print("Testing complexity classification:")
+    print("=" * 60)
+    failed = 0
+    for name, func in tests:
+        try:
+            func()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {name}: {e}")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
+    raise SystemExit(1 if failed else 0)
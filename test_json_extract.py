@@ -0,0 +1,95 @@
+"""
+Test script to verify JSON extraction from LLM responses
+
+Runs offline. Run with `python test_json_extract.py` or `python -m pytest test_json_extract.py`.
+"""
+from utils.json_extract import JsonObjectScanner, json_dumps, json_loads, parse_json_object
+
+PLAN = {"task": "filter", "filters": [{"column": "Age", "condition": ">", "value": 30}]}
+
+
+def test_bare_json():
+    assert parse_json_object(json_dumps(PLAN)) == PLAN
+
+
+def test_fenced_json():
+    content = "```json\n" + json_dumps(PLAN) + "\n```"
+    assert parse_json_object(content) == PLAN
+
+
+def test_prose_wrapped_json():
+    content = "Here is the plan: " + json_dumps(PLAN) + " Let me know if you need anything else."
+    assert parse_json_object(content) == PLAN
+
+
+def test_stray_brace_before_object():
+    content = "Use {column} placeholders. " + json_dumps(PLAN)
+    assert parse_json_object(content) == PLAN
+
+
+def test_braces_inside_strings():
+    plan = {"task": "formula", "formula": {"code": "df['x'] = '{' + df['y'] + '}'"}}
+    assert parse_json_object("Result:\n" + json_dumps(plan) + "\n}") == plan
+
+
+def test_no_object():
+    assert parse_json_object("") is None
+    assert parse_json_object("no json here") is None
+    assert parse_json_object('{"task": "sort"') is None
+    assert parse_json_object("[1, 2, 3]") is None
+
+
+def test_json_dumps_is_compact_and_round_trips():
+    text = json_dumps({"name": "Café", "values": [1, 2]})
+    assert text == '{"name":"Café","values":[1,2]}'
+    assert json_loads(text) == {"name": "Café", "values": [1, 2]}
+
+
+def _scan(chunks):
+    scanner = JsonObjectScanner()
+    parts = []
+    for chunk in chunks:
+        if scanner.done:
+            break
+        parts.append(scanner.feed(chunk))
+    return scanner, "".join(parts)
+
+
+def test_scanner_brace_split_across_chunks():
+    text = json_dumps(PLAN)
+    # Every possible split point, including right before the closing brace
+    for i in range(1, len(text)):
+        scanner, scanned = _scan([text[:i], text[i:] + " trailing"])
+        assert scanner.done, i
+        assert scanned == text, i
+
+
+def test_scanner_escaped_quotes_across_chunks():
+    text = '{"code": "df[\\"a}\\"] = \\"{\\\\\\""}'
+    assert json_loads(text) == {"code": 'df["a}"] = "{\\"'}
+    for i in range(1, len(text)):
+        scanner, scanned = _scan([text[:i], text[i:], "{}"])
+        assert scanner.done, i
+        assert scanned == text, i
+
+
+def test_scanner_incomplete_object():
+    scanner, scanned = _scan(['{"task": ', '"sort", "sort": {"column": "A"'])
+    assert not scanner.done
+    assert scanned == '{"task": "sort", "sort": {"column": "A"'
+
+
+if __name__ == "__main__":
+    tests = [(name, func) for name, func in sorted(globals().items()) if name.startswith("test_")]
+    print("Testing JSON extraction:")
+    print("=" * 60)
+    failed = 0
+    for name, func in tests:
+        try:
+            func()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {name}: {e}")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
+    raise SystemExit(1 if failed else 0)
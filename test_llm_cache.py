@@ -0,0 +1,173 @@
+"""
+Test script to verify the LLM response caches (exact + semantic)
+
+Runs offline: embeddings are passed in directly, so no model or API key is needed.
+Run with `python test_llm_cache.py` or `python -m pytest test_llm_cache.py`.
+"""
+import os
+import tempfile
+
+import numpy as np
+
+from services.llm_cache import (
+    CacheStore, ExactCache, SemanticCache, columns_signature, prompt_literals, sample_signature,
+)
+
+COLUMNS = ["Name", "Age", "Region"]
+COLUMNS_KEY = tuple(COLUMNS)
+
+
+def _unit(values):
+    vector = np.asarray(values, dtype=np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+def test_exact_hit_and_miss():
+    cache = ExactCache(ttl=0)
+    sample = [{"Name": "Ann", "Age": 31, "Region": "North"}]
+    sample_key = sample_signature(sample)
+    cache.put("sort by Age", COLUMNS_KEY, {"plan": 1}, sample_key)
+    
+    assert cache.get("sort by Age", COLUMNS_KEY, sample_key) == {"plan": 1}
+    assert cache.get("sort by Name", COLUMNS_KEY, sample_key) is None
+    assert cache.get("sort by Age", columns_signature(["Age", "Name", "Region"]), sample_key) is None
+    other_sample = sample_signature([{"Name": "Bob", "Age": 45, "Region": "South"}])
+    assert cache.get("sort by Age", COLUMNS_KEY, other_sample) is None
+
+
+def test_exact_results_are_copies():
+    cache = ExactCache(ttl=0)
+    result = {"action_plan": {"task": "sort"}}
+    cache.put("sort", COLUMNS_KEY, result)
+    result["action_plan"]["task"] = "changed"
+    hit = cache.get("sort", COLUMNS_KEY)
+    hit["action_plan"]["task"] = "changed again"
+    assert cache.get("sort", COLUMNS_KEY) == {"action_plan": {"task": "sort"}}
+
+
+def test_exact_lru_eviction():
+    cache = ExactCache(max_entries=2, ttl=0)
+    cache.put("a", COLUMNS_KEY, {"plan": "a"})
+    cache.put("b", COLUMNS_KEY, {"plan": "b"})
+    cache.get("a", COLUMNS_KEY)  # "b" is now least recently used
+    cache.put("c", COLUMNS_KEY, {"plan": "c"})
+    assert cache.get("b", COLUMNS_KEY) is None
+    assert cache.get("a", COLUMNS_KEY) == {"plan": "a"}
+    assert cache.get("c", COLUMNS_KEY) == {"plan": "c"}
+
+
+def test_exact_ttl_expiry():
+    cache = ExactCache(ttl=60)
+    cache.put("sort by Age", COLUMNS_KEY, {"plan": 1})
+    assert cache.get("sort by Age", COLUMNS_KEY) == {"plan": 1}
+    for key, (stored_at, result) in list(cache._entries.items()):
+        cache._entries[key] = (stored_at - 120, result)
+    assert cache.get("sort by Age", COLUMNS_KEY) is None
+
+
+def test_semantic_hit_and_miss():
+    cache = SemanticCache(threshold=0.93, ttl=0)
+    literals = prompt_literals("sort by Age", COLUMNS)
+    cache.put(_unit([1.0, 0.0, 0.0, 0.0]), COLUMNS_KEY, {"plan": 1}, literals, "s1")
+    
+    # Paraphrase: close embedding, same gates
+    assert cache.get(_unit([1.0, 0.1, 0.0, 0.0]), COLUMNS_KEY, literals, "s1") == {"plan": 1}
+    # Unrelated prompt
+    assert cache.get(_unit([0.0, 1.0, 0.0, 0.0]), COLUMNS_KEY, literals, "s1") is None
+    # Same prompt, different layout or different sample rows
+    assert cache.get(_unit([1.0, 0.0, 0.0, 0.0]), ("Age", "Name"), literals, "s1") is None
+    assert cache.get(_unit([1.0, 0.0, 0.0, 0.0]), COLUMNS_KEY, literals, "s2") is None
+    # Same wording, different literal
+    assert cache.get(
+        _unit([1.0, 0.0, 0.0, 0.0]), COLUMNS_KEY, prompt_literals("sort by Name", COLUMNS), "s1"
+    ) is None
+
+
+def test_literal_gate():
+    embedding = _unit([1.0, 0.0, 0.0, 0.0])
+    cache = SemanticCache(threshold=0.93, ttl=0)
+    first = "delete rows where Age > 30"
+    cache.put(embedding, COLUMNS_KEY, {"plan": first}, prompt_literals(first, COLUMNS))
+    for other in ("delete rows where Age > 40", "delete rows where Region > 30",
+                  "delete rows where Name is 'Ann'"):
+        assert cache.get(embedding, COLUMNS_KEY, prompt_literals(other, COLUMNS)) is None, other
+    # Case of the wording doesn't matter, only the literals themselves
+    assert cache.get(
+        embedding, COLUMNS_KEY, prompt_literals("Delete rows where AGE > 30", COLUMNS)
+    ) == {"plan": first}
+
+
+def test_semantic_ttl_expiry():
+    embedding = _unit([1.0, 0.0, 0.0, 0.0])
+    cache = SemanticCache(threshold=0.93, ttl=60)
+    cache.put(embedding, COLUMNS_KEY, {"plan": 1})
+    assert cache.get(embedding, COLUMNS_KEY) == {"plan": 1}
+    for entry in cache._entries:
+        entry.stored_at -= 120
+    assert cache.get(embedding, COLUMNS_KEY) is None
+
+
+def test_semantic_eviction_keeps_popular_entries():
+    cache = SemanticCache(threshold=0.99, max_entries=2, ttl=0)
+    popular = _unit([1.0, 0.0, 0.0])
+    cache.put(popular, COLUMNS_KEY, {"plan": "popular"})
+    cache.put(_unit([0.0, 1.0, 0.0]), COLUMNS_KEY, {"plan": "one-off"})
+    assert cache.get(popular, COLUMNS_KEY) == {"plan": "popular"}
+    cache.put(_unit([0.0, 0.0, 1.0]), COLUMNS_KEY, {"plan": "new"})
+    assert cache.get(popular, COLUMNS_KEY) == {"plan": "popular"}
+    assert cache.get(_unit([0.0, 1.0, 0.0]), COLUMNS_KEY) is None
+    assert cache.get(_unit([0.0, 0.0, 1.0]), COLUMNS_KEY) == {"plan": "new"}
+
+
+def test_persistence_round_trip():
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "cache.db")
+        embedding = _unit([1.0, 0.0, 0.0, 0.0])
+        literals = prompt_literals("sort by Age", COLUMNS)
+        
+        store = CacheStore(path)
+        ExactCache(store=store, ttl=0).put("sort by Age", COLUMNS_KEY, {"plan": "exact"}, "s1")
+        SemanticCache(store=store, ttl=0).put(embedding, COLUMNS_KEY, {"plan": "semantic"}, literals, "s1")
+        store.flush()
+        
+        # A fresh process would load both caches back from the file
+        store = CacheStore(path)
+        assert ExactCache(store=store, ttl=0).get("sort by Age", COLUMNS_KEY, "s1") == {"plan": "exact"}
+        semantic = SemanticCache(store=store, ttl=0)
+        assert semantic.get(embedding, COLUMNS_KEY, literals, "s1") == {"plan": "semantic"}
+        assert semantic.get(embedding, COLUMNS_KEY, literals, "s2") is None
+        store.flush()  # the hit count update, before the directory goes away
+
+
+def test_polarity_words_split_semantic_entries():
+    """Prompts differing only in direction/polarity/style must not share a plan"""
+    pairs = [
+        ("sort by Age ascending", "sort by Age descending"),
+        ("keep rows where Region is empty", "remove rows where Region is empty"),
+        ("highlight Age above 30 in green", "highlight Age above 30 in red"),
+        ("make Name bold", "make Name italic"),
+        ("show rows where Age > 30", "show rows where Age < 30"),
+    ]
+    # Same embedding for both prompts: the worst case for the similarity check
+    embedding = _unit([1.0, 0.2, 0.1, 0.0])
+    for first, second in pairs:
+        cache = SemanticCache(threshold=0.93, ttl=0)
+        cache.put(embedding, COLUMNS_KEY, {"plan": first}, prompt_literals(first, COLUMNS))
+        assert cache.get(embedding, COLUMNS_KEY, prompt_literals(first, COLUMNS)) == {"plan": first}
+        assert cache.get(embedding, COLUMNS_KEY, prompt_literals(second, COLUMNS)) is None, (first, second)
+
+
+if __name__ == "__main__":
+    tests = [(name, func) for name, func in sorted(globals().items()) if name.startswith("test_")]
+    print("Testing LLM caches:")
+    print("=" * 60)
+    failed = 0
+    for name, func in tests:
+        try:
+            func()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {name}: {e}")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
+    raise SystemExit(1 if failed else 0)
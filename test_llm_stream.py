@@ -0,0 +1,87 @@
+"""
+Test script to verify streamed JSON completions
+
+Uses a stand-in client that replays canned stream chunks, so no API key or
+network access is needed. Run with `python test_llm_stream.py` or
+`python -m pytest test_llm_stream.py`.
+"""
+from types import SimpleNamespace
+
+from services.llm_stream import stream_json_completion
+
+
+def _chunk(content=None, usage=None):
+    choices = [] if content is None else [SimpleNamespace(delta=SimpleNamespace(content=content))]
+    return SimpleNamespace(choices=choices, usage=usage)
+
+
+def _usage(prompt_tokens, completion_tokens, cached_tokens=None):
+    details = None if cached_tokens is None else SimpleNamespace(cached_tokens=cached_tokens)
+    return SimpleNamespace(
+        prompt_tokens=prompt_tokens, completion_tokens=completion_tokens, prompt_tokens_details=details
+    )
+
+
+class _FakeClient:
+    """Minimal stand-in for OpenAI(): chat.completions.create returns the chunks"""
+
+    def __init__(self, chunks):
+        self.consumed = 0
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+        self._chunks = chunks
+
+    def _create(self, **kwargs):
+        assert kwargs["stream"] is True
+        assert kwargs["response_format"] == {"type": "json_object"}
+        for chunk in self._chunks:
+            self.consumed += 1
+            yield chunk
+
+
+def test_brace_split_across_deltas():
+    chunks = [
+        _chunk('{"task": "sort", "sort": {"column": "A"'),
+        _chunk("}"),
+        _chunk("}"),
+        _chunk("\n\n"),
+        _chunk(usage=_usage(120, 15, 64)),
+    ]
+    client = _FakeClient(chunks)
+    content, prompt_tokens, completion_tokens, cached_tokens = stream_json_completion(client, "m", [])
+    assert content == '{"task": "sort", "sort": {"column": "A"}}'
+    assert (prompt_tokens, completion_tokens, cached_tokens) == (120, 15, 64)
+
+
+def test_stream_drained_for_usage():
+    chunks = [
+        _chunk('{"task": "summarize"}'),
+        _chunk(" ignored trailing text {"),
+        _chunk(usage=_usage(200, 10)),
+    ]
+    client = _FakeClient(chunks)
+    content, prompt_tokens, completion_tokens, cached_tokens = stream_json_completion(client, "m", [])
+    # Nothing after the object is kept, but the final usage chunk is still read
+    assert content == '{"task": "summarize"}'
+    assert client.consumed == len(chunks)
+    assert (prompt_tokens, completion_tokens, cached_tokens) == (200, 10, 0)
+
+
+def test_missing_usage_counts_as_zero():
+    client = _FakeClient([_chunk('{"task": "sort"}')])
+    assert stream_json_completion(client, "m", []) == ('{"task": "sort"}', 0, 0, 0)
+
+
+if __name__ == "__main__":
+    tests = [(name, func) for name, func in sorted(globals().items()) if name.startswith("test_")]
+    print("Testing streamed JSON completions:")
+    print("=" * 60)
+    failed = 0
+    for name, func in tests:
+        try:
+            func()
+            print(f"✅ {name}")
+        except AssertionError as e:
+            failed += 1
+            print(f"❌ {name}: {e}")
+    print(f"\n{len(tests) - failed}/{len(tests)} passed")
+    raise SystemExit(1 if failed else 0)
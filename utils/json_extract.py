@@ -0,0 +1,117 @@
+"""
+JSON Extraction Utilities
+
+Parses JSON objects out of LLM responses. Extraction uses a linear
+brace-depth scan or the stdlib decoder's raw_decode, so malformed or deeply
+nested output can't trigger regex backtracking.
+"""
+
+import json
+from typing import Dict, Optional
+
+try:
+    import orjson
+except ImportError:  # Optional: falls back to stdlib json
+    orjson = None
+
+
+def json_loads(content: str):
+    """
+    Parse JSON text, using orjson when installed.
+    
+    orjson.JSONDecodeError subclasses json.JSONDecodeError, so callers can keep
+    catching the stdlib exception either way.
+    """
+    if orjson is not None:
+        return orjson.loads(content)
+    return json.loads(content)
+
+
+_DECODER = json.JSONDecoder()
+
+
+def parse_json_object(content: str) -> Optional[Dict]:
+    """
+    Parse the first JSON object in an LLM response.
+    
+    Bare JSON (the norm in JSON mode) takes the json_loads fast path. Otherwise
+    raw_decode is tried from each "{" in turn: it parses exactly one value and
+    ignores whatever follows, so code fences, surrounding prose and stray
+    braces before the object don't break parsing.
+    
+    Returns:
+        The parsed object, or None if no complete JSON object is present
+    """
+    try:
+        result = json_loads(content)
+        if isinstance(result, dict):
+            return result
+    except json.JSONDecodeError:
+        pass
+    
+    start = content.find("{")
+    while start != -1:
+        try:
+            return _DECODER.raw_decode(content, start)[0]
+        except json.JSONDecodeError:
+            start = content.find("{", start + 1)
+    return None
+
+
+def json_dumps(obj) -> str:
+    """
+    Serialize to compact JSON text, using orjson when installed.
+    
+    No spaces after separators, and non-ASCII text is written as-is (not
+    \\u-escaped), matching orjson. Falls back to the stdlib for values orjson
+    can't encode.
+    """
+    if orjson is not None:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS).decode("utf-8")
+        except TypeError:  # orjson.JSONEncodeError, e.g. unsupported types
+            pass
+    return json.dumps(obj, separators=(",", ":"), ensure_ascii=False)
+
+
+class JsonObjectScanner:
+    """
+    Incrementally tracks brace depth over (possibly streamed) text.
+    
+    Finds the end of the first top-level {...} object in a single linear pass -
+    no regex backtracking on malformed or deeply nested output. Braces inside
+    string literals are ignored.
+    """
+    
+    def __init__(self):
+        self.depth = 0
+        self.in_string = False
+        self.escaped = False
+        self.done = False
+    
+    def feed(self, text: str) -> str:
+        """
+        Consume the next piece of text
+        
+        Returns:
+            The part of text up to and including the closing brace of the first
+            object (the whole text if the object is still open)
+        """
+        for i, ch in enumerate(text):
+            if self.in_string:
+                if self.escaped:
+                    self.escaped = False
+                elif ch == "\\":
+                    self.escaped = True
+                elif ch == '"':
+                    self.in_string = False
+            elif ch == '"' and self.depth > 0:
+                self.in_string = True
+            elif ch == "{":
+                self.depth += 1
+            elif ch == "}" and self.depth > 0:
+                self.depth -= 1
+                if self.depth == 0:
+                    self.done = True
+                    return text[:i + 1]
+        return text
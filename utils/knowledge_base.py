@@ -8,6 +8,9 @@ Structured knowledge base containing:
 - Validation rules
 """
 
+import re
+from functools import lru_cache
+
 KNOWLEDGE_BASE = {
     "task_definitions": {
         "clean": {
@@ -414,10 +417,12 @@ KNOWLEDGE_BASE = {
 }
 
 
+@lru_cache(maxsize=None)
 def get_knowledge_base_summary() -> str:
     """
     Get a formatted summary of the knowledge base for inclusion in prompts
     Optimized for token efficiency - only essential information
+    Cached - the knowledge base only changes via add_example_to_knowledge_base
     
     Returns:
         Formatted string with key knowledge base information
@@ -466,12 +471,29 @@ def add_example_to_knowledge_base(example_type: str, example: dict):
             KNOWLEDGE_BASE[example_type][key] = example
     else:
         KNOWLEDGE_BASE[example_type] = [example] if isinstance(example, dict) else example
+    
+    get_knowledge_base_summary.cache_clear()
+    get_chart_knowledge_base_summary.cache_clear()
+
 
+# Task hint keywords, one named group per suggested task. Longer phrases
+# that contain a shorter keyword are left out ("remove duplicates" is
+# covered by "duplicate", "group by" by "group", "statistical" by "statistic")
+_TASK_HINT_PATTERN = re.compile(
+    r"(?P<clean>clean|fix formatting|duplicate|remove empty)"
+    r"|(?P<summarize>summary|statistic|describe)"
+    r"|(?P<group_by>group|sum by|count by)"
+)
+# Precedence when a prompt mentions several kinds of task
+_TASK_HINT_ORDER = ("clean", "summarize", "group_by")
 
+
+@lru_cache(maxsize=2048)
 def get_task_decision_guide(user_prompt: str) -> dict:
     """
     Analyze user prompt and suggest task based on knowledge base
     Optimized for token efficiency - minimal output
+    Cached per prompt - callers must treat the returned dict as read-only
     
     Args:
         user_prompt: User's natural language request
@@ -479,32 +501,16 @@ def get_task_decision_guide(user_prompt: str) -> dict:
     Returns:
         Dictionary with suggested task (simplified)
     """
-    prompt_lower = user_prompt.lower()
-    
-    # Quick keyword checks (most common patterns first)
-    # Check for cleaning keywords
-    cleaning_keywords = ["clean", "remove duplicates", "fix formatting", "duplicate", "remove empty"]
-    has_cleaning = any(keyword in prompt_lower for keyword in cleaning_keywords)
-    
-    # Check for statistics keywords
-    stats_keywords = ["summary", "statistics", "describe", "statistical"]
-    has_stats = any(keyword in prompt_lower for keyword in stats_keywords)
-    
-    # Check for grouping keywords
-    group_keywords = ["group", "group by", "sum by", "count by"]
-    has_group = any(keyword in prompt_lower for keyword in group_keywords)
-    
-    # Decision logic (simplified - only return task, no verbose reasoning)
-    if has_cleaning:
-        return {"suggested_task": "clean"}
-    elif has_stats:
-        return {"suggested_task": "summarize"}
-    elif has_group:
-        return {"suggested_task": "group_by"}
-    else:
-        return {"suggested_task": "auto-detect"}
+    # One scan tags every keyword category present; the first category in
+    # _TASK_HINT_ORDER that matched wins
+    matched = {match.lastgroup for match in _TASK_HINT_PATTERN.finditer(user_prompt.lower())}
+    for task in _TASK_HINT_ORDER:
+        if task in matched:
+            return {"suggested_task": task}
+    return {"suggested_task": "auto-detect"}
 
 
+@lru_cache(maxsize=None)
 def get_chart_knowledge_base_summary() -> str:
     """
     Get chart-specific knowledge base summary for ChartBot
@@ -6,6 +6,7 @@ Contains system prompts and templates for LLM interpretation
 
 from __future__ import annotations
 
+from functools import lru_cache
 from typing import Optional, List
 import re
 
@@ -1186,7 +1187,7 @@ Example 5: "remove the initial dot from phone numbers column"
 }
 """
 
-def get_prompt_with_context(user_prompt: str, available_columns: list, sample_data: Optional[list] = None, total_rows: Optional[int] = None) -> str:
+def get_prompt_with_context(user_prompt: str, available_columns: list, sample_data: Optional[list] = None, total_rows: Optional[int] = None, include_system_prompt: bool = True) -> str:
     """
     Generate prompt with context about available columns and sample data
     
@@ -1194,6 +1195,8 @@ def get_prompt_with_context(user_prompt: str, available_columns: list, sample_da
         user_prompt: User's natural language request
         available_columns: List of available column names
         sample_data: Optional list of sample rows (dicts) to help LLM understand data structure
+        include_system_prompt: Prepend SYSTEM_PROMPT. Callers that already send it
+            as part of a static system message pass False
         
     Returns:
         Formatted prompt string
@@ -1261,17 +1264,21 @@ Use this sample to:
 
 """
         
-        # Format as a table-like structure - include ALL rows
+        # Format as a table-like structure - include ALL rows. The row header is
+        # repeated for every sample row, so it is kept plain: decorative
+        # box-drawing characters cost several tokens each and carry nothing
+        row_parts = [sample_data_text]
         for row_idx, row in enumerate(sample_data, 1):
-            sample_data_text += f"━━━ ROW {row_idx} ━━━\n"
+            row_parts.append(f"ROW {row_idx}:\n")
             for col in available_columns:
                 col_label = str(col)
                 value = row.get(col, row.get(col_label, ""))
                 # Truncate extremely long values to avoid token bloat (keep up to 300 chars)
                 if isinstance(value, str) and len(value) > 300:
                     value = value[:300] + "..."
-                sample_data_text += f"  [{col_label}]: {value}\n"
-            sample_data_text += "\n"
+                row_parts.append(f"  [{col_label}]: {value}\n")
+            row_parts.append("\n")
+        sample_data_text = "".join(row_parts)
         
         # Build positional reference helper safely
         first_col = available_columns[0] if available_columns else 'N/A'
@@ -1367,7 +1374,7 @@ EXAMPLES OF CORRECT BEHAVIOR:
     
     # Build prompt by concatenating SYSTEM_PROMPT (which has JSON examples) with f-string
     # This prevents Python from interpreting curly braces in SYSTEM_PROMPT as format specifiers
-    prompt = SYSTEM_PROMPT + f"""
+    prompt = f"""
 
 ═══════════════════════════════════════════════════════════════════════════════
 📋 USER REQUEST:
@@ -1488,6 +1495,8 @@ CRITICAL: In ALL cases above, you MUST return the actual column_name from availa
 
 Generate the action plan JSON now. Return ONLY valid JSON, no markdown, no code blocks, pure JSON."""
     
+    if include_system_prompt:
+        prompt = SYSTEM_PROMPT + prompt
     return prompt
 
 
@@ -1606,10 +1615,16 @@ def get_column_mapping_info(available_columns: List[str]) -> str:
     """
     if not available_columns:
         return ""
-    
+    return _column_mapping_for(tuple(available_columns))
+
+
+@lru_cache(maxsize=256)
+def _column_mapping_for(columns: tuple) -> str:
+    """Build the mapping line for get_column_mapping_info (memoized per layout)"""
     # Ultra-concise format: "A=Col1, B=Col2, C=Col3"
+    # Only the first 10 columns are shown, so only those get letters computed
     mapping_parts = []
-    for idx, col_name in enumerate(available_columns):
+    for idx, col_name in enumerate(columns[:10]):
         # Convert index to Excel column letter (A=0, B=1, ..., Z=25, AA=26, etc.)
         excel_letter = ""
         temp_idx = idx + 1
@@ -1620,5 +1635,4 @@ def get_column_mapping_info(available_columns: List[str]) -> str:
         mapping_parts.append(f"{excel_letter}={col_name}")
     
     # Single line format
-    return f"Columns: {', '.join(mapping_parts[:10])}" + ("..." if len(mapping_parts) > 10 else "")
-
+    return f"Columns: {', '.join(mapping_parts)}" + ("..." if len(columns) > 10 else "")